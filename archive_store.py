@@ -0,0 +1,353 @@
+import datetime
+import json
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from query import IMAGE_EXTENSIONS, message_features
+from attachment_manifest import viewer_cache_path
+from message_store import file_extension, has_link
+
+# Stored in the viewer folder near messages.json
+DB_SUFFIX = '.sqlite'
+# Changing the schema makes old databases convert again
+SCHEMA_VERSION = '2'
+# Fields that have their own columns, the rest of the message goes to the data column
+COLUMN_FIELDS = ('creator', 'created_date', 'updated_date', 'text', 'message_id',
+                 'message_number', 'main_date', 'month_date', 'year_date')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS messages (
+    number INTEGER PRIMARY KEY,
+    message_id TEXT,
+    creator_name TEXT,
+    creator_email TEXT,
+    created_date TEXT,
+    updated_date TEXT,
+    ts REAL,
+    year INTEGER,
+    month INTEGER,
+    text TEXT,
+    data TEXT,
+    has_link INTEGER
+);
+CREATE INDEX IF NOT EXISTS messages_year_month ON messages (year, month, number);
+CREATE INDEX IF NOT EXISTS messages_creator ON messages (creator_name);
+CREATE TABLE IF NOT EXISTS attachments (
+    number INTEGER,
+    export_name TEXT,
+    original_name TEXT
+);
+CREATE INDEX IF NOT EXISTS attachments_number ON attachments (number);
+'''
+# Tables of an older schema are dropped, convert() fills the new ones
+DROP_SCHEMA = '''
+DROP TABLE IF EXISTS messages_fts;
+DROP TABLE IF EXISTS messages;
+DROP TABLE IF EXISTS attachments;
+DROP TABLE IF EXISTS meta;
+'''
+
+
+def database_path(json_path):
+    name = os.path.splitext(os.path.basename(json_path))[0]
+    return viewer_cache_path(os.path.dirname(json_path), name + DB_SUFFIX)
+
+
+def python_contains(text, query):
+    # Case-insensitive substring like in the viewer, SQLite lower() knows only ASCII
+    return 1 if text and query in text.lower() else 0
+
+
+class ArchiveStore:
+    # messages.json converted once into SQLite with FTS5 (trigram) over the texts
+    # Every thread gets its own connection
+
+    def __init__(self, db_path):
+        # Imported only in the database mode
+        import sqlite3
+        self.db_path = db_path
+        self._local = threading.local()
+        self.has_fts = False
+        connection = self.connection()
+        if self.schema_version() not in (None, SCHEMA_VERSION):
+            connection.executescript(DROP_SCHEMA)
+        connection.executescript(SCHEMA)
+        try:
+            connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(text, content='messages', content_rowid='number', tokenize='trigram')")
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # SQLite without FTS5 or trigram tokenizer, search will scan the table
+            self.has_fts = False
+        connection.commit()
+
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            import sqlite3
+            connection = sqlite3.connect(self.db_path)
+            connection.create_function('py_contains', 2, python_contains, deterministic=True)
+            self._local.connection = connection
+        return connection
+
+    def meta(self, key):
+        row = self.connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def schema_version(self):
+        # None for a new database
+        import sqlite3
+        try:
+            return self.meta('version')
+        except sqlite3.OperationalError:
+            return None
+
+    @staticmethod
+    def source_signature(json_path, locale_str):
+        stat_result = os.stat(json_path)
+        return {'version': SCHEMA_VERSION, 'source_size': str(stat_result.st_size),
+                'source_mtime': str(stat_result.st_mtime), 'locale': locale_str or ''}
+
+    def is_fresh(self, json_path, locale_str):
+        # The database was made from this file with this locale
+        signature = self.source_signature(json_path, locale_str)
+        return all(self.meta(key) == value for key, value in signature.items())
+
+    def convert(self, json_path, locale_str, messages, batch_size=5000, should_stop=None):
+        # messages - iterable of loaded messages (numbers, dates and export names already set)
+        # should_stop() is checked with every batch, False if it stopped - the database stays as it was
+        connection = self.connection()
+        connection.execute("DELETE FROM meta")
+        connection.execute("DELETE FROM messages")
+        connection.execute("DELETE FROM attachments")
+        if self.has_fts:
+            connection.execute("INSERT INTO messages_fts(messages_fts) VALUES('delete-all')")
+
+        rows = []
+        attachments = []
+        for message_data in messages:
+            rows.append(self.message_row(message_data))
+            number = message_data['message_number']
+            for attached_file in message_data.get('attached_files', []):
+                attachments.append((number, attached_file.get('export_name'), attached_file.get('original_name')))
+            if len(rows) >= batch_size:
+                if should_stop and should_stop():
+                    connection.rollback()
+                    return False
+                self.insert(rows, attachments)
+                rows, attachments = [], []
+        self.insert(rows, attachments)
+
+        if self.has_fts:
+            connection.execute("INSERT INTO messages_fts(messages_fts) VALUES('rebuild')")
+        connection.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                               self.source_signature(json_path, locale_str).items())
+        connection.commit()
+        return True
+
+    @staticmethod
+    def message_row(message_data):
+        creator = message_data.get('creator', {})
+        main_date = message_data.get('main_date')
+        data = {key: value for key, value in message_data.items() if key not in COLUMN_FIELDS}
+        return (message_data['message_number'], message_data.get('message_id'), creator.get('name'), creator.get('email'),
+                message_data.get('created_date'), message_data.get('updated_date'),
+                main_date.timestamp() if main_date else None,
+                message_data.get('year_date') and int(message_data['year_date']), message_data.get('month_date'),
+                message_data.get('text'), json.dumps(data, ensure_ascii=False) if data else None,
+                # has:link is the same check as in the loaded list
+                1 if 'link' in message_features(message_data)['has'] else 0)
+
+    def insert(self, rows, attachments):
+        connection = self.connection()
+        connection.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        connection.executemany("INSERT INTO attachments VALUES (?, ?, ?)", attachments)
+
+    # Reading
+
+    def count(self):
+        return self.connection().execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def fetch_range(self, start_number, end_number):
+        # Messages with start_number <= number < end_number as dicts
+        cursor = self.connection().execute(
+            "SELECT number, message_id, creator_name, creator_email, created_date, updated_date, ts, year, month, text, data "
+            "FROM messages WHERE number >= ? AND number < ? ORDER BY number", (start_number, end_number))
+        return [self.message_from_row(row) for row in cursor]
+
+    @staticmethod
+    def message_from_row(row):
+        number, message_id, creator_name, creator_email, created_date, updated_date, ts, year, month, text, data = row
+        message_data = json.loads(data) if data else {}
+        message_data['message_number'] = number
+        message_data['message_id'] = message_id
+        message_data['creator'] = {'name': creator_name, 'email': creator_email}
+        if created_date is not None:
+            message_data['created_date'] = created_date
+        if updated_date is not None:
+            message_data['updated_date'] = updated_date
+        if text is not None:
+            message_data['text'] = text
+        message_data['main_date'] = datetime.datetime.fromtimestamp(ts, datetime.timezone.utc) if ts is not None else None
+        message_data['month_date'] = month
+        message_data['year_date'] = str(year) if year is not None else None
+        return message_data
+
+    def year_months(self):
+        # {year string: [month numbers]} in order
+        structure = defaultdict(list)
+        for year, month in self.connection().execute(
+                "SELECT DISTINCT year, month FROM messages WHERE year IS NOT NULL ORDER BY year, month"):
+            structure[str(year)].append(month)
+        return structure
+
+    def month_start(self, year, month):
+        # The first message of the month or None
+        row = self.connection().execute(
+            "SELECT MIN(number) FROM messages WHERE year = ? AND month = ?", (int(year), month)).fetchone()
+        return row[0] if row else None
+
+    def query(self, search_query):
+        # Numbers of messages for a query.SearchQuery, SQLite picks the indexes
+        clauses = []
+        params = []
+        text = search_query.text.lower()
+        if text:
+            if self.has_fts and len(text) >= 3:
+                clauses.append("number IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)")
+                params.append('"' + text.replace('"', '""') + '"')
+            clauses.append("py_contains(text, ?)")
+            params.append(text)
+        if search_query.senders:
+            clauses.append("(" + " OR ".join("py_contains(creator_name, ?)" for _ in search_query.senders) + ")")
+            params.extend(search_query.senders)
+        if search_query.start_timestamp is not None:
+            clauses.append("ts >= ?")
+            params.append(search_query.start_timestamp)
+        if search_query.end_timestamp is not None:
+            clauses.append("ts < ?")
+            params.append(search_query.end_timestamp)
+        if 'attachment' in search_query.has:
+            clauses.append("EXISTS (SELECT 1 FROM attachments a WHERE a.number = messages.number)")
+        if 'image' in search_query.has:
+            clauses.append("EXISTS (SELECT 1 FROM attachments a WHERE a.number = messages.number AND (" +
+                           " OR ".join("lower(a.export_name) LIKE ?" for _ in IMAGE_EXTENSIONS) + "))")
+            params.extend('%' + extension for extension in IMAGE_EXTENSIONS)
+        for extension in search_query.extensions:
+            clauses.append("EXISTS (SELECT 1 FROM attachments a WHERE a.number = messages.number AND lower(a.export_name) LIKE ?)")
+            params.append('%.' + extension)
+        if 'link' in search_query.has:
+            clauses.append("has_link = 1")
+
+        where = " AND ".join(clauses) if clauses else "1"
+        cursor = self.connection().execute(f"SELECT number FROM messages WHERE {where} ORDER BY number", params)
+        return [row[0] for row in cursor]
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class StoredMessageList:
+    # Read-only list of messages over ArchiveStore, only recently used pages stay in memory
+    # Index 0 is the zero message, like in the loaded list
+    # Has the same accessor API as message_store.MessageStore
+
+    def __init__(self, store, page_size=200, pages_limit=20):
+        self.store = store
+        self.page_size = page_size
+        self.pages_limit = pages_limit
+        self._length = store.count() + 1
+        self._pages = OrderedDict()
+        # The search worker reads pages too
+        self._lock = threading.Lock()
+        self._zero_message = {'message_number': 0, 'main_date': None, 'month_date': None, 'year_date': None}
+
+    def __len__(self):
+        return self._length
+
+    def _page(self, page_number):
+        # Messages page_number * page_size ... page_number * page_size + page_size - 1
+        with self._lock:
+            page = self._pages.get(page_number)
+            if page is None:
+                start = page_number * self.page_size
+                page = self.store.fetch_range(start, start + self.page_size)
+                self._pages[page_number] = page
+                if len(self._pages) > self.pages_limit:
+                    self._pages.popitem(last=False)
+            else:
+                self._pages.move_to_end(page_number)
+            return page
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            # One range query for the page of the viewer
+            messages = self.store.fetch_range(max(start, 1), stop) if stop > max(start, 1) else []
+            if start == 0 and stop > 0:
+                messages.insert(0, self._zero_message)
+            return messages
+
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('message index out of range')
+        if index == 0:
+            return self._zero_message
+        # Numbers go from 1 without gaps, the first page has no zero message
+        page_number = index // self.page_size
+        first_number = max(page_number * self.page_size, 1)
+        return self._page(page_number)[index - first_number]
+
+    def __iter__(self):
+        for i in range(self._length):
+            yield self[i]
+
+    def text(self, i):
+        return self[i].get('text', '')
+
+    def creator_name(self, i):
+        return self[i].get('creator', {}).get('name')
+
+    def timestamp(self, i):
+        main_date = self[i].get('main_date')
+        return int(main_date.timestamp()) if main_date else None
+
+    def year_month(self, i):
+        message_data = self[i]
+        if message_data.get('year_date') is None:
+            return None, None
+        return int(message_data['year_date']), message_data['month_date']
+
+    def attachment_count(self, i):
+        return len(self[i].get('attached_files', ()))
+
+    def attachment_extensions(self, i):
+        return tuple(file_extension(attached_file.get('export_name')) for attached_file in self[i].get('attached_files', ()))
+
+    def has_link(self, i):
+        return has_link(self[i])
+
+    def year_months(self):
+        return self.store.year_months()
+
+    def month_start(self, year, month):
+        return self.store.month_start(year, month)
+
+
+def open_archive_store(json_path, locale_str, load_messages, should_stop=None):
+    # Database for the file: the existing one if it is fresh, otherwise converted with load_messages()
+    # None if the conversion was stopped
+    db_path = database_path(json_path)
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    store = ArchiveStore(db_path)
+    if not store.is_fresh(json_path, locale_str):
+        if not store.convert(json_path, locale_str, load_messages(), should_stop=should_stop):
+            store.close()
+            return None
+    return store
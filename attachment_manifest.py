@@ -0,0 +1,119 @@
+import os
+import threading
+
+# Pictures shown in the page, gifs stay files like in the renderer
+IMAGE_EXTENSIONS = ('.jpg', '.png', '.jpeg')
+# Caches of the viewer live in one hidden folder of the chat:
+# writing them changes only that folder, the watcher of the attachments does not hear about it
+VIEWER_DIR_NAME = '.gcv'
+
+
+def viewer_cache_path(directory, *names):
+    return os.path.join(directory, VIEWER_DIR_NAME, *names)
+
+
+def directory_key(directory):
+    # The window gets folders with forward slashes from QFileDialog, the export - from os.path, both mean the same folder
+    return os.path.normcase(os.path.abspath(directory))
+
+
+def attachment_kind(name):
+    lower_name = name.lower()
+    if lower_name.endswith(IMAGE_EXTENSIONS):
+        return 'image'
+    if lower_name.endswith('.gif'):
+        return 'gif'
+    return 'file'
+
+
+class ManifestEntry:
+    # Size and mtime are named like in os.stat_result, so ImageSizeCache.get takes the entry as it is
+
+    __slots__ = ('st_size', 'st_mtime', 'kind')
+
+    def __init__(self, st_size, st_mtime, kind):
+        self.st_size = st_size
+        self.st_mtime = st_mtime
+        self.kind = kind
+
+
+class AttachmentManifest:
+    # Files of the archive folder from one os.scandir pass: export name -> ManifestEntry
+    # The renderer asks the manifest instead of the disk, refresh() makes new entries only for the files that changed
+    # Hidden files are the caches of the viewer, they are not attachments
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.key = directory_key(directory)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.scan()
+
+    def _read_entries(self, known=None):
+        # Entries of the new and rewritten files, the known unchanged ones are taken as they are
+        entries = {}
+        try:
+            with os.scandir(self.directory or os.curdir) as directory_entries:
+                for entry in directory_entries:
+                    name = entry.name
+                    if name.startswith('.'):
+                        continue
+                    try:
+                        if not entry.is_file():
+                            continue
+                        # Windows gives the stat with the directory listing, other systems read it here once
+                        stat_result = entry.stat()
+                    except OSError:
+                        continue
+                    known_entry = known.get(name) if known is not None else None
+                    if (known_entry is not None and known_entry.st_mtime == stat_result.st_mtime
+                            and known_entry.st_size == stat_result.st_size):
+                        entries[name] = known_entry
+                        continue
+                    entries[name] = ManifestEntry(stat_result.st_size, stat_result.st_mtime, attachment_kind(name))
+        except OSError:
+            pass
+        return entries
+
+    def scan(self):
+        entries = self._read_entries()
+        with self._lock:
+            self._entries = entries
+
+    def refresh(self):
+        # After a change in the folder, names of the files that came, went or were written again
+        with self._lock:
+            known = self._entries
+        entries = self._read_entries(known)
+        # Unchanged files keep their entry objects
+        changed = {name for name in entries.keys() | known.keys() if entries.get(name) is not known.get(name)}
+        with self._lock:
+            self._entries = entries
+        return changed
+
+    def get(self, name):
+        # None if there is no such file
+        return self._entries.get(name)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_current_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def get_attachment_manifest(directory):
+    # Manifest of the opened archive, the loading thread and the window can ask for it at the same time
+    global _current_manifest
+    with _manifest_lock:
+        if _current_manifest is None or _current_manifest.key != directory_key(directory):
+            _current_manifest = AttachmentManifest(directory)
+        return _current_manifest
+
+
+def use_attachment_manifest(manifest):
+    # A chat from the chat cache brings its manifest back
+    global _current_manifest
+    with _manifest_lock:
+        _current_manifest = manifest
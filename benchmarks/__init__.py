@@ -0,0 +1,3 @@
+# Headless timing of the viewer stages on synthetic archives:
+#   python -m benchmarks.run --messages 100000 --locale ru_RU
+#   python -m benchmarks.generate_archive /tmp/archive --messages 10000
@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+import random
+import icu
+from PyQt5.QtGui import QImage, QColor
+from date_parser import DATE_PATTERN
+
+WORDS = ('hello', 'message', 'archive', 'meeting', 'tomorrow', 'link', 'photo', 'report', 'lunch', 'done',
+         'привет', 'сообщение', 'завтра', 'встреча', 'отчёт', 'спасибо', 'ok', 'thanks', 'see', 'you')
+NAMES = ('Alice Smith', 'Bob Jones', 'Carol White', 'Dan Brown', 'Eve Black')
+# Export names repeat like in real archives, the viewer renames them to name(1).ext, name(2).ext ...
+ATTACHMENT_NAMES = ('photo.jpg', 'photo.jpg', 'image.png', 'scan.jpeg', 'document.pdf', 'animation.gif')
+
+
+def date_formatter(locale_str):
+    formatter = icu.SimpleDateFormat(DATE_PATTERN, icu.Locale(locale_str))
+    formatter.setTimeZone(icu.TimeZone.createTimeZone('UTC'))
+    return formatter
+
+
+def random_text(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(1, 40))]
+    if rng.random() < 0.1:
+        # Multiline messages
+        words.insert(rng.randint(0, len(words)), '\n')
+    return ' '.join(words)
+
+
+def make_message(rng, number, timestamp, formatter):
+    name = rng.choice(NAMES)
+    created_date = formatter.format(float(timestamp))
+    if rng.random() < 0.05:
+        # Some exports have the narrow no-break space before the time zone
+        created_date = created_date.replace(' UTC', '\u202fUTC')
+    message_data = {
+        'creator': {'name': name, 'email': name.split()[0].lower() + '@example.com', 'user_type': 'Human'},
+        'created_date': created_date,
+        'text': random_text(rng),
+        'message_id': f'space/{number}',
+        'topic_id': f'topic/{number // 20}',
+    }
+    if rng.random() < 0.03:
+        message_data['updated_date'] = formatter.format(float(timestamp + rng.randint(60, 3600)))
+    if rng.random() < 0.05:
+        start_index = rng.randint(0, 5)
+        message_data['text'] += ' https://example.com/page'
+        message_data['annotations'] = [{
+            'start_index': start_index,
+            'length': 5,
+            'url_metadata': {'title': 'Example page', 'snippet': 'Snippet of the page',
+                             'url': {'private_do_not_access_or_else_safe_url_wrapped_value': 'https://example.com/page'}},
+        }]
+    if rng.random() < 0.05:
+        message_data['quoted_message_metadata'] = {'creator': {'name': rng.choice(NAMES)}, 'text': random_text(rng)}
+    return message_data
+
+
+def export_file_name(export_name, seen_names):
+    # The name of the file on disk after the viewer numbers the repeats
+    count = seen_names.get(export_name)
+    seen_names[export_name] = 0 if count is None else count + 1
+    if count is None:
+        return export_name
+    base_name, ext = os.path.splitext(export_name)
+    return f"{base_name}({count + 1}){ext}"
+
+
+def write_image(path, rng):
+    image = QImage(rng.randint(100, 1200), rng.randint(100, 900), QImage.Format_RGB32)
+    image.fill(QColor(rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+    image.save(path)
+
+
+def generate_archive(directory, messages=10000, locale_str='en_US', attachment_rate=0.05, write_files=True, seed=1):
+    # Writes directory/messages.json and the attached files, returns the path of messages.json
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    formatter = date_formatter(locale_str)
+    seen_names = {}
+    timestamp = 1577836800  # 2020-01-01
+
+    path = os.path.join(directory, 'messages.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"messages": [\n')
+        for number in range(messages):
+            timestamp += rng.randint(1, 7200)
+            message_data = make_message(rng, number, timestamp, formatter)
+            if rng.random() < attachment_rate:
+                attached_files = []
+                for _ in range(rng.randint(1, 2)):
+                    export_name = rng.choice(ATTACHMENT_NAMES)
+                    attached_files.append({'original_name': export_name, 'export_name': export_name})
+                    file_path = os.path.join(directory, export_file_name(export_name, seen_names))
+                    if write_files and not os.path.exists(file_path):
+                        if export_name.endswith(('.jpg', '.jpeg', '.png')):
+                            write_image(file_path, rng)
+                        else:
+                            with open(file_path, 'wb') as attached:
+                                attached.write(b'GIF89a' if export_name.endswith('.gif') else b'%PDF-1.4\n')
+                message_data['attached_files'] = attached_files
+
+            f.write(json.dumps(message_data, ensure_ascii=False, indent=2))
+            f.write(',\n' if number < messages - 1 else '\n')
+        f.write(']}\n')
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Synthetic Google Chat archive')
+    parser.add_argument('directory')
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--locale', default='en_US', help='locale of the dates, e.g. en_US, ru_RU, de_DE')
+    parser.add_argument('--attachment-rate', type=float, default=0.05)
+    parser.add_argument('--no-files', action='store_true', help='do not write the attached files')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    path = generate_archive(args.directory, args.messages, args.locale, args.attachment_rate, not args.no_files, args.seed)
+    print(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Settings look for config.ini near the started script, the benchmark uses the one of the viewer
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.argv[0] = os.path.join(ROOT, 'main_form.py')
+
+from benchmarks.generate_archive import generate_archive
+from messages_model import Settings, chat_data
+from messages_loader import load_json, prepare_date_structure, create_html_page
+from fragment_cache import fragment_cache
+from thumbnails import get_thumbnail_cache
+from search_index import TrigramIndex
+from query import FieldIndex, parse_query, plan_query
+from message_store import MessageView
+
+
+class Stage:
+    # Time and peak of Python allocations of one stage
+    # tracemalloc makes allocations slower, --no-memory gives clean times
+    results = []
+    trace_memory = True
+
+    def __init__(self, name, items=None):
+        self.name = name
+        self.items = items
+
+    def __enter__(self):
+        self.peak = None
+        if self.trace_memory:
+            tracemalloc.start()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.started
+        if self.trace_memory:
+            _, self.peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        Stage.results.append(self)
+
+    def report(self):
+        throughput = f"{self.items / self.seconds:12.0f}/s" if self.items and self.seconds else ' ' * 14
+        peak = f"{self.peak / 2 ** 20:9.1f} MB" if self.peak is not None else ''
+        return f"{self.name:40} {self.seconds * 1000:10.1f} ms {throughput} {peak}"
+
+
+def run(path, pages=50, searches=('message', 'привет отчёт', 'from:alice has:image', 'date:2020-03 meeting')):
+    # path - messages.json, the archive is read like in the viewer
+    with Stage('load_json') as stage:
+        messages_data, directory = load_json(path)
+    stage.items = len(messages_data)
+    chat_data.messages_list = chat_data.original_messages_list = messages_data
+    total = len(messages_data)
+
+    with Stage('prepare_date_structure'):
+        prepare_date_structure(messages_data)
+
+    rng = random.Random(1)
+    starts = [rng.randint(1, max(total - 50, 1)) for _ in range(pages)]
+    fragment_cache.clear()
+    with Stage('create_html_page (cold)', pages * 50):
+        for start in starts:
+            create_html_page(800, directory, messages_data, start, start + 50)
+    with Stage('create_html_page (cached)', pages * 50):
+        for start in starts:
+            create_html_page(800, directory, messages_data, start, start + 50)
+
+    search_index = TrigramIndex()
+    field_index = FieldIndex()
+    with Stage('search index build', total):
+        search_index.build(messages_data)
+        field_index.build(messages_data)
+
+    for source in searches:
+        search_query = parse_query(source)
+        with Stage(f'search "{source}"', total) as stage:
+            results = MessageView(messages_data)
+            for number in plan_query(search_query, messages_data, field_index, search_index, messages_data.timeline):
+                results.append(number)
+        stage.name += f' ({len(results) - 1})'
+        with Stage(f'scan "{source}"', total):
+            found = sum(1 for i in range(1, total) if search_query.matches(messages_data, i))
+        assert found == len(results) - 1
+
+    months = [(year, month) for year, month_list in messages_data.year_months().items() for month in month_list]
+    with Stage('month jumps', len(months) * 100):
+        for _ in range(100):
+            for year, month in months:
+                messages_data.month_start(year, month)
+
+    return Stage.results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Timing of the viewer stages without the GUI')
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--locale', default='en_US')
+    parser.add_argument('--archive', help='existing messages.json instead of a generated one')
+    parser.add_argument('--directory', help='where to generate the archive (a temporary directory by default)')
+    parser.add_argument('--pages', type=int, default=50, help='pages of 50 messages to render')
+    parser.add_argument('--no-memory', action='store_true', help='do not trace the peak memory')
+    args = parser.parse_args()
+    Stage.trace_memory = not args.no_memory
+
+    # The dates of the archive are parsed with its locale
+    Settings().config.set('settings', 'locale', args.locale)
+
+    directory = None
+    path = args.archive
+    if path is None:
+        directory = args.directory or tempfile.mkdtemp(prefix='gcv_benchmark_')
+        started = time.perf_counter()
+        path = generate_archive(directory, args.messages, args.locale)
+        print(f"Generated {args.messages} messages in {time.perf_counter() - started:.1f} s: {path}")
+
+    try:
+        print(f"{'stage':40} {'time':>13} {'throughput':>14} {'peak':>12}")
+        for stage in run(path, args.pages):
+            print(stage.report())
+    finally:
+        get_thumbnail_cache(os.path.dirname(path)).shutdown()
+        if directory and not args.directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
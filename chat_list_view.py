@@ -0,0 +1,249 @@
+import re
+from collections import OrderedDict
+from PyQt5.QtWidgets import QListView, QStyledItemDelegate, QStyle, QAbstractItemView
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QPersistentModelIndex, QSize, QUrl, QEvent, QTimer, pyqtSignal
+from PyQt5.QtGui import QTextDocument, QAbstractTextDocumentLayout, QPalette
+from messages_loader import create_html_page
+from messages_model import chat_data
+from image_cache import document_image
+from thumbnails import picture_width
+
+# Role with the message number of the row
+MessageNumberRole = Qt.UserRole + 1
+
+
+class MessageListModel(QAbstractListModel):
+    # Rows over chat_data.messages_list, the zero message is skipped
+    # The list can grow in the loading thread, so the view sees only the announced rows
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rows = 0
+
+    @staticmethod
+    def messages_count():
+        return max(0, len(chat_data.messages_list or []) - 1)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._rows
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == MessageNumberRole:
+            return index.row() + 1
+        if role == Qt.DisplayRole:
+            return chat_data.messages_list.text(index.row() + 1)
+        return None
+
+    def reset_messages(self):
+        self.beginResetModel()
+        self._rows = self.messages_count()
+        self.endResetModel()
+
+    def messages_appended(self):
+        # New rows from the loading thread
+        rows = self.messages_count()
+        if rows > self._rows:
+            self.beginInsertRows(QModelIndex(), self._rows, rows - 1)
+            self._rows = rows
+            self.endInsertRows()
+
+
+class MessageDocument(QTextDocument):
+    # Document of one row, pictures come from the same cache as in the text browser
+
+    def __init__(self, display_width):
+        super().__init__()
+        self.display_width = display_width
+
+    def loadResource(self, resource_type, url):
+        if resource_type == QTextDocument.ImageResource:
+            image = document_image(url, self.display_width)
+            if image is not None:
+                return image
+        return super().loadResource(resource_type, url)
+
+
+class MessageDelegate(QStyledItemDelegate):
+    # Paints messages with QTextDocument, only visible rows are laid out
+    # Rows that were not painted yet get a cheap estimated height
+
+    link_clicked = pyqtSignal(QUrl)
+
+    def __init__(self, parent=None, documents_limit=300):
+        super().__init__(parent)
+        self.documents_limit = documents_limit
+        # (row, width) -> QTextDocument
+        self._documents = OrderedDict()
+        # row -> exact QSize for the current width
+        self._size_hints = {}
+        # Rows measured while painting, the view hears about them after the paint
+        self._changed_indexes = []
+        self._width = 0
+
+    def clear(self):
+        self._documents.clear()
+        self._size_hints.clear()
+
+    def clear_documents(self):
+        # Rows keep their measured heights until they are painted again
+        self._documents.clear()
+
+    def set_width(self, width):
+        if width != self._width:
+            self._width = width
+            self.clear()
+
+    def document(self, row, font):
+        key = (row, self._width)
+        document = self._documents.get(key)
+        if document is None:
+            document = MessageDocument(picture_width(self._width))
+            document.setDefaultFont(font)
+            html = create_html_page(self._width, chat_data.main_dir, chat_data.messages_list, row + 1, row + 2)
+            document.setHtml(html)
+            document.setTextWidth(self._width)
+            self._documents[key] = document
+            if len(self._documents) > self.documents_limit:
+                self._documents.popitem(last=False)
+        else:
+            self._documents.move_to_end(key)
+        return document
+
+    def documents(self):
+        return self._documents.values()
+
+    def estimate_height(self, row, option):
+        # Without laying out: header lines, wrapped text and pictures
+        messages = chat_data.messages_list
+        metrics = option.fontMetrics
+        line_height = metrics.lineSpacing()
+        # Text takes the half of the width
+        chars_in_line = max(1, (self._width // 2) // max(1, metrics.averageCharWidth()))
+        text = messages.text(row + 1)
+        lines = 4 + text.count('\n') + len(text) // chars_in_line
+        height = lines * line_height
+        height += messages.attachment_count(row + 1) * (self._width // 4)
+        return height
+
+    def sizeHint(self, option, index):
+        row = index.row()
+        size = self._size_hints.get(row)
+        if size is None:
+            return QSize(self._width, self.estimate_height(row, option))
+        return size
+
+    def paint(self, painter, option, index):
+        row = index.row()
+        document = self.document(row, option.font)
+        size = QSize(self._width, int(document.size().height()))
+
+        if self._size_hints.get(row) != size:
+            self._size_hints[row] = size
+            # The estimation was wrong, the view must move the rows below
+            # A layout started from inside paint() makes the view flicker, so it is queued
+            if not self._changed_indexes:
+                QTimer.singleShot(0, self.emit_size_changes)
+            self._changed_indexes.append(QPersistentModelIndex(index))
+
+        painter.save()
+        if option.state & QStyle.State_Selected:
+            painter.fillRect(option.rect, option.palette.alternateBase())
+        painter.translate(option.rect.topLeft())
+        painter.setClipRect(0, 0, option.rect.width(), option.rect.height())
+        context = QAbstractTextDocumentLayout.PaintContext()
+        context.palette.setColor(QPalette.Text, option.palette.color(QPalette.Text))
+        document.documentLayout().draw(painter, context)
+        painter.restore()
+
+    def emit_size_changes(self):
+        changed_indexes, self._changed_indexes = self._changed_indexes, []
+        for index in changed_indexes:
+            # Rows can be gone after a reset
+            if index.isValid():
+                self.sizeHintChanged.emit(QModelIndex(index))
+
+    def editorEvent(self, event, model, option, index):
+        # Links inside the message
+        if event.type() == QEvent.MouseButtonRelease and event.button() == Qt.LeftButton:
+            document = self.document(index.row(), option.font)
+            position = event.pos() - option.rect.topLeft()
+            anchor = document.documentLayout().anchorAt(position)
+            if anchor:
+                self.link_clicked.emit(QUrl(anchor))
+                return True
+        return super().editorEvent(event, model, option, index)
+
+
+class ChatListView(QListView):
+    # Alternative chat pane: the scroll bar covers the whole history
+    link_clicked = pyqtSignal(QUrl)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.messages_model = MessageListModel(self)
+        self.delegate = MessageDelegate(self)
+        self.setModel(self.messages_model)
+        self.setItemDelegate(self.delegate)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setUniformItemSizes(False)
+        self.setResizeMode(QListView.Adjust)
+        # Rows are placed in batches, so a huge archive doesn't block the window
+        self.setLayoutMode(QListView.Batched)
+        self.setBatchSize(500)
+        self.setWordWrap(True)
+        self.delegate.link_clicked.connect(self.link_clicked)
+
+    def resizeEvent(self, event):
+        self.delegate.set_width(self.viewport().width())
+        super().resizeEvent(event)
+
+    def setFont(self, font):
+        super().setFont(font)
+        self.delegate.clear()
+        self.scheduleDelayedItemsLayout()
+
+    def reset_messages(self):
+        self.delegate.clear()
+        self.messages_model.reset_messages()
+
+    def redraw_messages(self):
+        # Messages are rendered again in place, the rows that changed their height are moved after the paint
+        self.delegate.clear_documents()
+        self.viewport().update()
+
+    def messages_appended(self):
+        self.messages_model.messages_appended()
+
+    def scroll_to_message(self, message_number):
+        index = self.messages_model.index(message_number - 1)
+        if index.isValid():
+            self.scrollTo(index, QAbstractItemView.PositionAtTop)
+            self.setCurrentIndex(index)
+
+    def find_text(self, text, whole_words=False):
+        # Next message with the text after the current one
+        text = text.lower()
+        # Words end at punctuation too, like with FindWholeWords of the text browser
+        word_re = re.compile(r'\b' + re.escape(text) + r'\b') if whole_words else None
+        start = self.currentIndex().row() + 1 if self.currentIndex().isValid() else 0
+        messages = chat_data.messages_list
+        for row in range(start, self.messages_model.rowCount()):
+            message_text = messages.text(row + 1).lower()
+            if word_re:
+                found = word_re.search(message_text) is not None
+            else:
+                found = text in message_text
+            if found:
+                self.scroll_to_message(row + 1)
+                return True
+        return False
+
+    def replace_image(self, url, image):
+        for document in self.delegate.documents():
+            document.addResource(QTextDocument.ImageResource, url, image)
+            document.markContentsDirty(0, document.characterCount())
+        self.viewport().update()
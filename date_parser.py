@@ -0,0 +1,74 @@
+import datetime
+import threading
+
+# Google archive date format, e.g. "четверг, 14 марта 2024 г. в 10:15:30 UTC"
+DATE_PATTERN = "EEEE, dd MMMM yyyy 'г.' 'в' HH:mm:ss z"
+
+
+class DateParser:
+    # One ICU formatter per locale (and per thread - SimpleDateFormat is not thread-safe)
+    # and a memo of the date strings we have already seen
+
+    def __init__(self, locale_str=None, memo_size=200000):
+        self.locale_str = locale_str
+        self.memo_size = memo_size
+        self._memo = {}
+        self._local = threading.local()
+
+    def _formatter(self):
+        formatter = getattr(self._local, 'formatter', None)
+        if formatter is None:
+            # ICU loads its data on import, the window is shown without it
+            import icu
+
+            if self.locale_str:
+                # Use loaded locale
+                locale = icu.Locale(self.locale_str)
+            else:
+                # Use default
+                locale = icu.Locale.getDefault()
+            formatter = icu.SimpleDateFormat(DATE_PATTERN, locale)
+            self._local.formatter = formatter
+        return formatter
+
+    def parse(self, date_str):
+        # Returns (datetime in UTC, month, year), month and year are ints
+        result = self._memo.get(date_str)
+        if result is None:
+            timestamp = self._formatter().parse(date_str.replace("\u202f", " "))
+            dt_object = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+            result = (dt_object, dt_object.month, dt_object.year)
+
+            if len(self._memo) >= self.memo_size:
+                self._memo.clear()
+            self._memo[date_str] = result
+        return result
+
+    def parse_many(self, date_strings):
+        # Batch version, None stays None
+        parse = self.parse
+        return [parse(date_str) if date_str else None for date_str in date_strings]
+
+
+_parsers = {}
+
+
+def get_date_parser(locale_str):
+    # Shared parser for the locale
+    parser = _parsers.get(locale_str)
+    if parser is None:
+        parser = _parsers.setdefault(locale_str, DateParser(locale_str))
+    return parser
+
+
+def parse_timestamps(locale_str, date_strings):
+    # Worker for the process pool: only strings and floats travel between processes
+    formatter = get_date_parser(locale_str)._formatter()
+    timestamps = []
+    for date_str in date_strings:
+        if date_str:
+            timestamps.append(formatter.parse(date_str.replace("\u202f", " ")))
+        else:
+            timestamps.append(None)
+    return timestamps
+
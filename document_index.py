@@ -0,0 +1,56 @@
+from bisect import bisect_right
+from profiling import profiler
+
+
+class AnchorIndex:
+    # message_number -> position of the message in the text browser document
+    # Built once after the page is set (the text browser turns <div id=''> into anchors)
+
+    def __init__(self, document=None):
+        self.positions = []
+        self.message_numbers = []
+        self._by_number = {}
+        if document is not None:
+            self.rebuild(document)
+
+    @profiler.profiled('anchor_index.rebuild')
+    def rebuild(self, document):
+        positions = []
+        message_numbers = []
+        block = document.begin()
+        while block.isValid():
+            iterator = block.begin()
+            while not iterator.atEnd():
+                fragment = iterator.fragment()
+                if fragment.isValid():
+                    for name in fragment.charFormat().anchorNames():
+                        if name.isdigit():
+                            positions.append(fragment.position())
+                            message_numbers.append(int(name))
+                iterator += 1
+            block = block.next()
+
+        self.positions = positions
+        self.message_numbers = message_numbers
+        self._by_number = dict(zip(message_numbers, positions))
+
+    def position_of(self, message_number):
+        # None if the message is not on the page
+        return self._by_number.get(int(message_number))
+
+    def message_at(self, position):
+        # The message that contains the document position
+        if not self.positions:
+            return None
+        i = bisect_right(self.positions, position) - 1
+        return self.message_numbers[max(i, 0)]
+
+    def visible_messages(self, text_browser):
+        # The first and the last message in the visible area
+        visible_rect = text_browser.viewport().rect()
+        first_position = text_browser.cursorForPosition(visible_rect.topLeft()).position()
+        last_position = text_browser.cursorForPosition(visible_rect.bottomRight()).position()
+        return self.message_at(first_position), self.message_at(last_position)
+
+    def __len__(self):
+        return len(self.positions)
@@ -0,0 +1,62 @@
+import sys
+import threading
+from collections import OrderedDict
+from messages_model import Settings
+
+# Browser width is rounded down to this step, so small resizes keep the cache
+WIDTH_STEP = 32
+
+
+def fragment_width(text_browser_width):
+    return max(WIDTH_STEP, int(text_browser_width) // WIDTH_STEP * WIDTH_STEP)
+
+
+class FragmentCache:
+    # Rendered HTML of single messages with LRU eviction by memory size
+    # Key: (message_number, width bucket, first_message_name, font size)
+
+    def __init__(self, max_bytes=None):
+        # None - the size from config.ini, read when the first fragment comes
+        self._max_bytes = max_bytes
+        self._fragments = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+            return fragment
+
+    @property
+    def max_bytes(self):
+        if self._max_bytes is None:
+            self._max_bytes = Settings().get_fragment_cache_mb() * 1024 * 1024
+        return self._max_bytes
+
+    def put(self, key, fragment):
+        size = sys.getsizeof(fragment)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old_fragment = self._fragments.pop(key, None)
+            if old_fragment is not None:
+                self._bytes -= sys.getsizeof(old_fragment)
+            self._fragments[key] = fragment
+            self._bytes += size
+            # The oldest fragments go first
+            while self._bytes > self.max_bytes:
+                _, evicted = self._fragments.popitem(last=False)
+                self._bytes -= sys.getsizeof(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._fragments)
+
+
+fragment_cache = FragmentCache()
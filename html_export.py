@@ -0,0 +1,242 @@
+import argparse
+import html
+import os
+import sys
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import quote
+from messages_model import Settings
+from messages_loader import iter_loaded_messages, render_message
+from image_probe import get_image_size_cache
+from attachment_manifest import get_attachment_manifest
+from thumbnails import make_thumbnail, thumbnail_file_name, width_bucket
+from takeout_catalog import chat_name
+from progress import ProgressTask
+from profiling import profiler
+
+# Folder of the copies of pictures inside the export
+EXPORT_THUMBNAILS_DIR_NAME = 'thumbnails'
+INDEX_FILE_NAME = 'index.html'
+PAGE_HEAD = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title>
+<style>body {{ font-family: sans-serif; max-width: {width}px; margin: 0 auto; }} nav {{ margin: 1em 0; }}</style>
+</head><body>
+"""
+PAGE_END = "</body></html>\n"
+
+
+class ExportOptions:
+    # Everything a page worker needs
+
+    def __init__(self, archive_dir, output_dir, width=800, attachments='thumbnail', first_message_name=None, title=''):
+        self.archive_dir = archive_dir
+        self.output_dir = output_dir
+        self.width = width
+        # "thumbnail" - pictures are shown by small copies in the export, "link" - by the originals
+        self.attachments = attachments
+        self.first_message_name = first_message_name
+        self.title = title
+
+
+class ExportImages:
+    # Relative links from the exported pages, thumbnails are made at once like in ThumbnailCache.image_url
+
+    def __init__(self, options):
+        self.options = options
+
+    def file_url(self, path):
+        try:
+            return quote(os.path.relpath(path, self.options.output_dir).replace(os.sep, '/'))
+        except ValueError:
+            # The export and the archive are on different Windows drives
+            return Path(path).as_uri()
+
+    def image_url(self, img_path, display_width, original_width):
+        bucket = width_bucket(display_width)
+        if original_width <= bucket:
+            return self.file_url(img_path)
+
+        thumbnail_path = os.path.join(self.options.output_dir, EXPORT_THUMBNAILS_DIR_NAME, str(bucket),
+                                      thumbnail_file_name(img_path, self.options.archive_dir))
+        if not os.path.exists(thumbnail_path):
+            try:
+                os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+                ok = make_thumbnail(img_path, thumbnail_path, bucket)
+            except OSError:
+                ok = False
+            if not ok:
+                return self.file_url(img_path)
+        return self.file_url(thumbnail_path)
+
+
+def page_key(message_data, page_by, page_size, count):
+    # Pages of one month or of page_size messages
+    if page_by == 'month':
+        if message_data.get('year_date') is None:
+            return 'undated'
+        return f"{message_data['year_date']}-{message_data['month_date']:02d}"
+    return f"page-{count // page_size + 1:04d}"
+
+
+def page_title(key, page_by, page):
+    if page_by == 'month':
+        return key
+    return f"{page[0]['message_number']}-{page[-1]['message_number']}"
+
+
+def iter_pages(messages, page_by='month', page_size=1000):
+    # (key, title, messages of the page), only one page is kept
+    page = []
+    key = None
+    for count, message_data in enumerate(messages):
+        message_key = page_key(message_data, page_by, page_size, count)
+        if page and message_key != key:
+            yield key, page_title(key, page_by, page), page
+            page = []
+        key = message_key
+        page.append(message_data)
+    if page:
+        yield key, page_title(key, page_by, page), page
+
+
+def page_file_name(key, used_names):
+    # A month that comes again after other months gets its own page
+    name = f"{key}.html"
+    number = 1
+    while name in used_names:
+        number += 1
+        name = f"{key}-{number}.html"
+    used_names.add(name)
+    return name
+
+
+def navigation(previous_name, next_name):
+    links = [f"<a href='{INDEX_FILE_NAME}'>Index</a>"]
+    if previous_name:
+        links.append(f"<a href='{quote(previous_name)}'>&larr; Previous</a>")
+    if next_name:
+        links.append(f"<a href='{quote(next_name)}'>Next &rarr;</a>")
+    return f"<nav>{' | '.join(links)}</nav>\n"
+
+
+def write_page(options, file_name, title, messages, previous_name, next_name):
+    # One page straight to its file, runs in the worker threads
+    image_sizes = get_image_size_cache(options.archive_dir)
+    manifest = get_attachment_manifest(options.archive_dir)
+    images = ExportImages(options)
+    thumbnails = images if options.attachments == 'thumbnail' else None
+    nav = navigation(previous_name, next_name)
+
+    path = os.path.join(options.output_dir, file_name)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(PAGE_HEAD.format(title=html.escape(f"{options.title} {title}"), width=options.width))
+        f.write(nav)
+        f.write(f"<h2>{html.escape(options.title)}: {html.escape(title)}</h2>\n")
+        for message_data in messages:
+            f.write(render_message(message_data, options.width, options.archive_dir, options.first_message_name,
+                                   image_sizes, thumbnails, manifest, file_url=images.file_url))
+            f.write("\n")
+        f.write(nav)
+        f.write(PAGE_END)
+    return len(messages)
+
+
+def write_index(options, pages):
+    with open(os.path.join(options.output_dir, INDEX_FILE_NAME), 'w', encoding='utf-8') as f:
+        f.write(PAGE_HEAD.format(title=html.escape(options.title), width=options.width))
+        f.write(f"<h1>{html.escape(options.title)}</h1>\n<ul>\n")
+        for file_name, title, count in pages:
+            f.write(f"<li><a href='{quote(file_name)}'>{html.escape(title)}</a> ({count})</li>\n")
+        f.write("</ul>\n")
+        f.write(PAGE_END)
+
+
+@profiler.profiled('export_html')
+def export_html(file_path, output_dir, page_by='month', page_size=1000, width=800, attachments='thumbnail',
+                workers=None, should_stop=None):
+    # Streams messages.json into pages of output_dir, returns [(file name, title, messages)] of the pages
+    # Messages are read one by one and pages are rendered in worker threads,
+    # at most two pages per worker wait in memory, so the memory does not grow with the chat
+    # Threads and not processes: sending a page to a process costs more than rendering it,
+    # and making thumbnails, the slow part, runs without the GIL
+    if workers is None:
+        workers = Settings().get_export_workers()
+    archive_dir = os.path.dirname(os.path.abspath(file_path))
+    output_dir = os.path.abspath(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    options = ExportOptions(archive_dir, output_dir, width, attachments,
+                            Settings().get_first_name() or None, chat_name(archive_dir))
+
+    progress = ProgressTask('export', [('export', 100)])
+    messages = iter_loaded_messages(file_path, progress, phase='export')
+
+    executor = None
+    if workers > 1:
+        executor = ThreadPoolExecutor(max_workers=workers)
+    pending = set()
+    pages = []
+    used_names = set()
+
+    def send_page(page, next_name):
+        if executor is None:
+            write_page(options, *page, next_name)
+        else:
+            pending.add(executor.submit(write_page, options, *page, next_name))
+
+    # A page is sent when the next one is known, for its "Next" link
+    waiting = None
+    try:
+        for key, title, page_messages in iter_pages(messages, page_by, page_size):
+            if should_stop and should_stop():
+                return None
+            if options.first_message_name is None:
+                options.first_message_name = page_messages[0]['creator']['name']
+            file_name = page_file_name(key, used_names)
+            if waiting:
+                send_page(waiting, file_name)
+            previous_name = pages[-1][0] if pages else None
+            pages.append((file_name, title, len(page_messages)))
+            waiting = (file_name, title, page_messages, previous_name)
+
+            # Rendered pages are dropped as soon as they are written
+            if executor and len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+        if waiting:
+            send_page(waiting, None)
+        for future in pending:
+            future.result()
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+        progress.finish()
+
+    write_index(options, pages)
+    # Sizes read for the pages are kept for the viewer
+    get_image_size_cache(archive_dir).save()
+    return pages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Static HTML pages of a chat, without the viewer')
+    parser.add_argument('archive', help='messages.json of the chat')
+    parser.add_argument('output', help='folder for the pages, index.html is the first one')
+    parser.add_argument('--by', choices=('month', 'count'), default='month', help='one page per month or per --page-size messages')
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--width', type=int, default=800, help='page width in pixels')
+    parser.add_argument('--attachments', choices=('thumbnail', 'link'), default='thumbnail',
+                        help='show pictures by small copies in the export or by the original files')
+    parser.add_argument('--workers', type=int, help='rendering threads, export_workers of config.ini by default')
+    parser.add_argument('--locale', help='locale of the dates, locale of config.ini by default')
+    args = parser.parse_args(argv)
+
+    if args.locale:
+        Settings().config.set('settings', 'locale', args.locale)
+    pages = export_html(args.archive, args.output, args.by, args.page_size, args.width, args.attachments, args.workers)
+    print(f"{len(pages)} pages, {sum(count for _, _, count in pages)} messages: {os.path.join(os.path.abspath(args.output), INDEX_FILE_NAME)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+from collections import OrderedDict
+from PyQt5.QtCore import QSize
+from PyQt5.QtGui import QImageReader
+from messages_model import Settings, chat_data
+from thumbnails import get_thumbnail_cache, placeholder_image, width_bucket
+from profiling import profiler
+
+
+class ImageResourceCache:
+    # Decoded pictures of the pages shared by all documents, LRU eviction by memory size
+    # Key: (file path, width bucket) - a picture is decoded once for every width it is shown at
+    # Used from the GUI thread only, like the documents
+
+    def __init__(self, max_bytes=None):
+        # None - the size from config.ini, read when the first picture comes
+        self._max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._bytes = 0
+
+    @property
+    def max_bytes(self):
+        if self._max_bytes is None:
+            self._max_bytes = Settings().get_image_cache_mb() * 1024 * 1024
+        return self._max_bytes
+
+    def image(self, path, width=None):
+        # QImage no wider than width, None if the file cannot be decoded
+        key = (path, width_bucket(width) if width else None)
+        image = self._images.get(key)
+        if image is not None:
+            self._images.move_to_end(key)
+            return image
+
+        with profiler.span('image_cache.decode'):
+            reader = QImageReader(path)
+            size = reader.size()
+            # Big originals are decoded straight into the smaller size, JPEG does it much faster
+            if key[1] and size.isValid() and size.width() > key[1]:
+                reader.setScaledSize(QSize(key[1], max(1, size.height() * key[1] // size.width())))
+            image = reader.read()
+        if image.isNull():
+            return None
+        self.put(key, image)
+        return image
+
+    def put(self, key, image):
+        size = image.sizeInBytes()
+        if size > self.max_bytes:
+            return
+        old_image = self._images.pop(key, None)
+        if old_image is not None:
+            self._bytes -= old_image.sizeInBytes()
+        self._images[key] = image
+        self._bytes += size
+        # The oldest pictures go first
+        while self._bytes > self.max_bytes:
+            _, evicted = self._images.popitem(last=False)
+            self._bytes -= evicted.sizeInBytes()
+
+    def discard(self, path):
+        # The file of the archive was changed or removed, its pictures are decoded again
+        for key in [key for key in self._images if key[0] == path]:
+            self._bytes -= self._images.pop(key).sizeInBytes()
+
+    def clear(self):
+        self._images.clear()
+        self._bytes = 0
+
+    def __len__(self):
+        return len(self._images)
+
+
+image_cache = ImageResourceCache()
+
+
+def document_image(url, display_width=None):
+    # Picture for QTextDocument.loadResource, None - Qt loads it as usual
+    if not url.isLocalFile() or not chat_data.main_dir:
+        return None
+    path = url.toLocalFile()
+    thumbnails = get_thumbnail_cache(chat_data.main_dir)
+    # Thumbnails that are still being made are shown as placeholders
+    if thumbnails.is_pending(path):
+        return placeholder_image()
+    # Cached pages keep the URL of a thumbnail that failed, the original is shown there
+    path = thumbnails.failed_original(path) or path
+    return image_cache.image(path, display_width)
@@ -0,0 +1,173 @@
+import json
+import os
+import struct
+import threading
+from attachment_manifest import viewer_cache_path, directory_key
+
+# The cache lives in the viewer folder near messages.json
+CACHE_FILE_NAME = 'image_sizes.json'
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# JPEG frame markers with the image size (C4, C8 and CC are not frames)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def read_header_size(f):
+    # Width and height from the first bytes of JPEG/PNG/GIF/WebP, None for other formats
+    head = f.read(30)
+
+    if head.startswith(PNG_SIGNATURE) and head[12:16] == b'IHDR':
+        width, height = struct.unpack('>II', head[16:24])
+        return width, height, True
+
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        width, height = struct.unpack('<HH', head[6:10])
+        # Text browser doesn't show animated gifs, so they stay files
+        return width, height, False
+
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP' and len(head) == 30:
+        chunk = head[12:16]
+        if chunk == b'VP8X':
+            # Canvas size minus one, 24 bits each
+            width = int.from_bytes(head[24:27], 'little') + 1
+            height = int.from_bytes(head[27:30], 'little') + 1
+            return width, height, True
+        if chunk == b'VP8 ' and head[23:26] == b'\x9d\x01\x2a':
+            width, height = struct.unpack('<HH', head[26:30])
+            return width & 0x3FFF, height & 0x3FFF, True
+        if chunk == b'VP8L' and head[20] == 0x2F:
+            bits = int.from_bytes(head[21:25], 'little')
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1, True
+        return None
+
+    if head[:2] == b'\xff\xd8':
+        f.seek(2)
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            # Fill bytes before the marker
+            while marker[1] == 0xFF:
+                marker = marker[1:] + f.read(1)
+                if len(marker) < 2:
+                    return None
+            code = marker[1]
+            if code == 0xD8 or code == 0x01 or 0xD0 <= code <= 0xD7:
+                continue
+            length_bytes = f.read(2)
+            if len(length_bytes) < 2:
+                return None
+            length = struct.unpack('>H', length_bytes)[0]
+            if code in JPEG_SOF_MARKERS:
+                frame = f.read(5)
+                if len(frame) < 5:
+                    return None
+                height, width = struct.unpack('>HH', frame[1:5])
+                return width, height, width > 0 and height > 0
+            if code == 0xDA or length < 2:
+                return None
+            f.seek(length - 2, os.SEEK_CUR)
+
+    return None
+
+
+def decode_image_size(img_path):
+    # Fallback for files we cannot read by header: full decoding like before
+    import cv2
+    import numpy as np
+
+    # CV2 cannot read non-latin filenames, so we are reading bytes ourselves
+    with open(img_path, "rb") as f:
+        chunk_arr = np.frombuffer(f.read(), dtype=np.uint8)
+    try:
+        image = cv2.imdecode(chunk_arr, cv2.IMREAD_COLOR)
+    except cv2.error:
+        # Empty file
+        image = None
+    if image is None:
+        return 0, 0, False
+    height, width, _ = image.shape
+    return width, height, True
+
+
+def probe_image_size(img_path):
+    # (width, height, is_decodable)
+    try:
+        with open(img_path, "rb") as f:
+            size = read_header_size(f)
+    except (OSError, struct.error):
+        return 0, 0, False
+    if size is None:
+        size = decode_image_size(img_path)
+    return size
+
+
+class ImageSizeCache:
+    # Image sizes stored on disk, the entry is valid while the file size and mtime are the same
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.key = directory_key(directory)
+        self.cache_path = viewer_cache_path(directory, CACHE_FILE_NAME)
+        self._entries = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        try:
+            with open(self.cache_path, encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def get(self, img_path, stat_result=None):
+        # None if there is no file
+        if stat_result is None:
+            try:
+                stat_result = os.stat(img_path)
+            except OSError:
+                return None
+
+        key = os.path.relpath(img_path, self.directory)
+        entry = self._entries.get(key)
+        if entry and entry[0] == stat_result.st_size and entry[1] == stat_result.st_mtime:
+            return entry[2], entry[3], entry[4]
+
+        width, height, decodable = probe_image_size(img_path)
+        with self._lock:
+            self._entries[key] = [stat_result.st_size, stat_result.st_mtime, width, height, decodable]
+            self._dirty = True
+        return width, height, decodable
+
+    def save(self):
+        if not self._dirty:
+            return
+        with self._lock:
+            data = json.dumps(self._entries)
+            self._dirty = False
+        # Archive folder can be read-only, then the cache lives only in memory
+        temporary_path = self.cache_path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(temporary_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(temporary_path, self.cache_path)
+        except OSError:
+            pass
+
+
+_current_cache = None
+
+
+def get_image_size_cache(directory):
+    # Cache of the opened archive
+    global _current_cache
+    if _current_cache is None or _current_cache.key != directory_key(directory):
+        if _current_cache is not None:
+            _current_cache.save()
+        _current_cache = ImageSizeCache(directory)
+    return _current_cache
+
+
+def save_image_size_cache():
+    # Sizes probed since the last save
+    if _current_cache is not None:
+        _current_cache.save()
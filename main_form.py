@@ -1,18 +1,58 @@
 import sys
-from PyQt5.QtWidgets import QApplication
-from window_model import MainWindow
-from messages_model import resource_path
-from PyQt5.QtGui import QIcon
+# Before everything else, it starts the startup timer
+from startup import startup_timer
+import os
+import json
+import multiprocessing
+
+# Startup times are printed, saved and the program exits when the window is shown
+STARTUP_REPORT_ARG = "--startup-report"
+STARTUP_REPORT_FILE = "startup_times.jsonl"
 
 if __name__ == "__main__":
+    # Date parsing processes in the onefile build
+    multiprocessing.freeze_support()
+
+    # main_form export messages.json folder - the HTML export without the window, also in the onefile build
+    if len(sys.argv) > 1 and sys.argv[1] == 'export':
+        from html_export import main
+        sys.exit(main(sys.argv[2:]))
+
+    # Qt and the viewer are imported here, so date parsing processes don't load them
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtGui import QIcon
+    from PyQt5.QtCore import QTimer
+    from window_model import MainWindow
+    from messages_model import resource_path
+    from profiling import profiler
+    startup_timer.mark('imports')
+
+    report_only = STARTUP_REPORT_ARG in sys.argv
+    if report_only:
+        sys.argv.remove(STARTUP_REPORT_ARG)
+
     # Should help for open files from a local drive
     sys.argv.append("--disable-web-security")
     
     app = QApplication(sys.argv)
+    startup_timer.mark('application')
 
     icon = resource_path('GCR.ico')
     app.setWindowIcon(QIcon(icon))
     main_form = MainWindow()
+    startup_timer.mark('main_window')
     main_form.show()
+
+    def on_shown():
+        # The first turn of the event loop has painted the window
+        startup_timer.mark('shown')
+        startup_timer.record(profiler)
+        if report_only or profiler.enabled:
+            startup_timer.save(os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), STARTUP_REPORT_FILE))
+        if report_only:
+            print(json.dumps(startup_timer.report()))
+            app.quit()
+
+    QTimer.singleShot(0, on_shown)
     
     sys.exit(app.exec_())
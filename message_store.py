@@ -0,0 +1,296 @@
+import datetime
+import json
+from array import array
+from collections import defaultdict
+from timeline import Timeline
+
+# Timestamp of messages without a date
+NO_DATE = -(1 << 63)
+# Fields kept in columns, the rest of the message is stored as JSON until it is needed
+COLUMN_FIELDS = ('creator', 'text', 'message_number', 'main_date', 'month_date', 'year_date')
+
+
+def file_extension(export_name):
+    # Lowercased extension of an attachment, '' without it
+    export_name = (export_name or '').lower()
+    return export_name.rsplit('.', 1)[1] if '.' in export_name else ''
+
+
+def has_link(message_data):
+    return any(annotation.get('url_metadata') for annotation in message_data.get('annotations', ()))
+
+
+class MessageStore:
+    # Compact message list: dates in int64 seconds, interned creators, texts as strings,
+    # other fields (ids, date strings, attachments, annotations, quotes) as UTF-8 JSON
+    #
+    # The accessor API (the same in StoredMessageList):
+    #   len(store), store[i] / store[a:b] - message dicts like in messages.json
+    #   text(i), creator_name(i), timestamp(i), year_month(i), attachment_count(i),
+    #   attachment_extensions(i), has_link(i)
+    #   year_months(), month_start(year, month)
+    # Position in the store is the message number
+
+    def __init__(self):
+        self.timestamps = array('q')
+        self.years = array('H')
+        self.months = array('B')
+        self.creator_ids = array('i')
+        self.attachment_counts = array('H')
+        self.link_flags = array('B')
+        # Tuples of attachment extensions, messages without files share the empty one
+        self.extensions = []
+        self.texts = []
+        self.raw = []
+        # Interned creators
+        self.creators = []
+        self._creator_numbers = {}
+        # Readers in other threads see only complete messages
+        self._count = 0
+        # Built when the list is complete
+        self.timeline = None
+
+    def __len__(self):
+        return self._count
+
+    def _creator_id(self, creator):
+        if not creator:
+            return -1
+        key = tuple(sorted(creator.items()))
+        creator_id = self._creator_numbers.get(key)
+        if creator_id is None:
+            creator_id = len(self.creators)
+            self.creators.append(dict(creator))
+            self._creator_numbers[key] = creator_id
+        return creator_id
+
+    def append(self, message_data):
+        main_date = message_data.get('main_date')
+        if main_date is not None:
+            self.timestamps.append(int(main_date.timestamp()))
+            self.years.append(int(message_data['year_date']))
+            self.months.append(message_data['month_date'])
+        else:
+            self.timestamps.append(NO_DATE)
+            self.years.append(0)
+            self.months.append(0)
+
+        self.creator_ids.append(self._creator_id(message_data.get('creator')))
+        attached_files = message_data.get('attached_files', ())
+        self.attachment_counts.append(len(attached_files))
+        self.extensions.append(tuple(file_extension(attached_file.get('export_name')) for attached_file in attached_files)
+                               if attached_files else ())
+        self.link_flags.append(1 if has_link(message_data) else 0)
+        self.texts.append(message_data.get('text'))
+        rest = {key: value for key, value in message_data.items() if key not in COLUMN_FIELDS}
+        self.raw.append(json.dumps(rest, ensure_ascii=False, separators=(',', ':')).encode('utf-8') if rest else b'')
+        self._count += 1
+
+    def set_timestamp(self, i, timestamp):
+        # For dates parsed after the message was added
+        if timestamp is None:
+            self.timestamps[i] = NO_DATE
+            self.years[i] = 0
+            self.months[i] = 0
+        else:
+            dt_object = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+            self.timestamps[i] = int(timestamp)
+            self.years[i] = dt_object.year
+            self.months[i] = dt_object.month
+
+    def message(self, i):
+        # Full message dict, made on request
+        raw = self.raw[i]
+        message_data = json.loads(raw) if raw else {}
+        creator_id = self.creator_ids[i]
+        if creator_id >= 0:
+            message_data['creator'] = self.creators[creator_id]
+        text = self.texts[i]
+        if text is not None:
+            message_data['text'] = text
+        message_data['message_number'] = i
+        timestamp = self.timestamps[i]
+        if timestamp != NO_DATE:
+            message_data['main_date'] = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+            message_data['month_date'] = self.months[i]
+            message_data['year_date'] = str(self.years[i])
+        else:
+            message_data['main_date'] = None
+            message_data['month_date'] = None
+            message_data['year_date'] = None
+        return message_data
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.message(i) for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('message index out of range')
+        return self.message(index)
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self.message(i)
+
+    # Column accessors, no dicts are made
+
+    def text(self, i):
+        return self.texts[i] or ''
+
+    def creator_name(self, i):
+        creator_id = self.creator_ids[i]
+        return self.creators[creator_id].get('name') if creator_id >= 0 else None
+
+    def timestamp(self, i):
+        # Seconds or None
+        timestamp = self.timestamps[i]
+        return None if timestamp == NO_DATE else timestamp
+
+    def year_month(self, i):
+        # (year, month) ints or (None, None)
+        if self.timestamps[i] == NO_DATE:
+            return None, None
+        return self.years[i], self.months[i]
+
+    def attachment_count(self, i):
+        return self.attachment_counts[i]
+
+    def attachment_extensions(self, i):
+        return self.extensions[i]
+
+    def has_link(self, i):
+        return bool(self.link_flags[i])
+
+    def build_timeline(self):
+        # Month starts and sorted dates for the complete list
+        self.timeline = Timeline.from_columns(self.timestamps, self.years, self.months, self._count, NO_DATE)
+        return self.timeline
+
+    def year_months(self):
+        # {year string: [month numbers]} in the order of messages
+        if self.timeline is not None:
+            return self.timeline.year_months()
+        structure = defaultdict(list)
+        seen = set()
+        years, months, timestamps = self.years, self.months, self.timestamps
+        for i in range(self._count):
+            if timestamps[i] != NO_DATE:
+                key = (years[i], months[i])
+                if key not in seen:
+                    seen.add(key)
+                    structure[str(years[i])].append(months[i])
+        return structure
+
+    def month_start(self, year, month):
+        # The first message of the month or None
+        if self.timeline is not None:
+            return self.timeline.month_start(year, month)
+        year = int(year)
+        years, months, timestamps = self.years, self.months, self.timestamps
+        for i in range(self._count):
+            if years[i] == year and months[i] == month and timestamps[i] != NO_DATE:
+                return i
+        return None
+
+
+class MessageView:
+    # Search results: positions of the found messages in the original list, nothing is copied
+    # Has the same accessor API, view[i] is the original message numbered by its place in the view
+    # Index 0 is the zero message of the original list
+
+    def __init__(self, base):
+        self.base = base
+        self.positions = array('I', [0])
+        self.timeline = None
+
+    def __len__(self):
+        return len(self.positions)
+
+    def append(self, original_number):
+        self.positions.append(original_number)
+
+    def original_number(self, i):
+        # Position of the message in the original list
+        return self.positions[i]
+
+    def message(self, i):
+        message_data = dict(self.base[self.positions[i]])
+        message_data['message_number'] = i
+        if i:
+            message_data['original_number'] = self.positions[i]
+        return message_data
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.message(i) for i in range(*index.indices(len(self.positions)))]
+        if index < 0:
+            index += len(self.positions)
+        if not 0 <= index < len(self.positions):
+            raise IndexError('message index out of range')
+        return self.message(index)
+
+    def __iter__(self):
+        for i in range(len(self.positions)):
+            yield self.message(i)
+
+    def text(self, i):
+        return self.base.text(self.positions[i])
+
+    def creator_name(self, i):
+        return self.base.creator_name(self.positions[i])
+
+    def timestamp(self, i):
+        return self.base.timestamp(self.positions[i])
+
+    def year_month(self, i):
+        return self.base.year_month(self.positions[i])
+
+    def attachment_count(self, i):
+        return self.base.attachment_count(self.positions[i])
+
+    def attachment_extensions(self, i):
+        return self.base.attachment_extensions(self.positions[i])
+
+    def has_link(self, i):
+        return self.base.has_link(self.positions[i])
+
+    def build_timeline(self):
+        # Date columns of the found messages only
+        timestamps = array('q')
+        years = array('H')
+        months = array('B')
+        for i in range(len(self.positions)):
+            timestamp = self.timestamp(i)
+            if timestamp is None:
+                timestamps.append(NO_DATE)
+                years.append(0)
+                months.append(0)
+            else:
+                year, month = self.year_month(i)
+                timestamps.append(timestamp)
+                years.append(year)
+                months.append(month)
+        self.timeline = Timeline.from_columns(timestamps, years, months, len(timestamps), NO_DATE)
+        return self.timeline
+
+    def year_months(self):
+        if self.timeline is not None:
+            return self.timeline.year_months()
+        structure = defaultdict(list)
+        seen = set()
+        for i in range(1, len(self.positions)):
+            year, month = self.year_month(i)
+            if year is not None and (year, month) not in seen:
+                seen.add((year, month))
+                structure[str(year)].append(month)
+        return structure
+
+    def month_start(self, year, month):
+        if self.timeline is not None:
+            return self.timeline.month_start(year, month)
+        year = int(year)
+        for i in range(1, len(self.positions)):
+            if self.year_month(i) == (year, month):
+                return i
+        return None
@@ -1,21 +1,23 @@
 import json
-import icu
+import codecs
+import html
+import re
 import os
-import cv2
-from PyQt5.QtCore import QObject, pyqtSignal, QUrl
-import datetime
+from PyQt5.QtCore import QUrl
 from messages_model import Settings, chat_data
-from calendar import month_name, different_locale
+from date_parser import get_date_parser, parse_timestamps
 from collections import defaultdict
-import numpy as np
+from functools import lru_cache
+from image_probe import get_image_size_cache
+from attachment_manifest import get_attachment_manifest
+from thumbnails import get_thumbnail_cache, picture_width
+from fragment_cache import fragment_cache, fragment_width
+from message_store import MessageStore
+from progress import ProgressTask
+from profiling import profiler
 
-class ProgressEmitter(QObject):
-    progress_changed = pyqtSignal(int)
-
-    def emit_progress(self, progress):
-        self.progress_changed.emit(progress)
-
-progress_emitter = ProgressEmitter()        
+# Beginning of the messages array in messages.json
+MESSAGES_ARRAY_RE = re.compile(r'"messages"\s*:\s*\[')
 
 
 def prepare_date_structure(messages_list):
@@ -24,22 +26,15 @@ def prepare_date_structure(messages_list):
     # The months dictionary
     year_month_structure = defaultdict(list)
 
-    # Looking for date
-    for message in messages_list:
-        # Получаем год и месяц из сообщения
-        year = message.get("year_date")
-        month = message.get("month_date")
-        
-        # Making structure
-        if year is not None and month is not None:
-            month_name = get_month_name(month, locale_str)
-            if (month, month_name) not in year_month_structure[year]:
-                year_month_structure[year].append((month, month_name))
+    # Years and months come from the date columns of the list
+    for year, months in messages_list.year_months().items():
+        year_month_structure[year] = [(month, get_month_name(month, locale_str)) for month in months]
     chat_data.date_structure = year_month_structure
 
 
 def get_month_list(months, locale):
     # Creating the full month dictionary
+    from calendar import month_name, different_locale
     temporary_dict = {}
     with different_locale(locale):
         for i in range(1, 13):
@@ -50,181 +45,414 @@ def get_month_list(months, locale):
    
     return sorted_months
 
-def get_month_name(month_no, locale):
+@lru_cache(maxsize=None)
+def get_month_names(locale):
+    # All 12 names with one locale switch
+    from calendar import month_name, different_locale
     with different_locale(locale):
-        return month_name[month_no]
-
-def parse_date_with_locale(date_str):
-    
-    date_str = date_str.replace("\u202f", " ")
-
-    locale_str = Settings().get_locale()
-
-    if locale_str:
-        # Use loaded locale
-        locale = icu.Locale(locale_str)
-    else:
-        # Use default
-        locale = icu.Locale.getDefault()
-
-    # Parcing date from messages
-    date_parser = icu.SimpleDateFormat("EEEE, dd MMMM yyyy 'г.' 'в' HH:mm:ss z", locale)
-    
-    parsed_date = date_parser.parse(date_str)
-    dt_object = datetime.datetime.fromtimestamp(parsed_date, datetime.timezone.utc)
-    m = int(dt_object.strftime("%m"))
-    y = dt_object.strftime("%Y")
+        return tuple(month_name[i] for i in range(13))
 
-    return dt_object, m, y
-
-def load_json(file_path):
-    # Main file loader
-    with open(file_path, encoding='utf-8') as f:
-        m_data = json.load(f)
-        messages_data = m_data.get('messages', [])
-        # zero message for comfortable iteration
-        messages_data.insert(0, {})
-        total_messages = len(messages_data) 
-        chat_data.total_messages = total_messages
-        directory = os.path.dirname(file_path)
-        chat_data.main_dir = directory
-        # Numeration and date parsing
-        for i, message_data in enumerate(messages_data):
-            message_data['message_number'] = i
-            if 'created_date' in message_data:
-                message_data['main_date'], message_data['month_date'], message_data['year_date'] = parse_date_with_locale(message_data['created_date'])
-            elif 'updated_date' in message_data:
-                message_data['main_date'], message_data['month_date'], message_data['year_date'] = parse_date_with_locale(message_data['updated_date'])
-                
+def get_month_name(month_no, locale):
+    return get_month_names(locale)[month_no]
+
+@lru_cache(maxsize=None)
+def get_month_numbers(locale):
+    # Month name in the local language -> number
+    return {name: i for i, name in enumerate(get_month_names(locale)) if name}
+
+def parse_date_with_locale(date_str, date_parser=None):
+    # The parser keeps ICU formatter and already parsed strings between calls
+    if date_parser is None:
+        date_parser = get_date_parser(Settings().get_locale())
+    dt_object, m, y = date_parser.parse(date_str)
+
+    return dt_object, m, str(y)
+
+def iter_json_messages(file_path, chunk_size=1 << 16):
+    # Streaming reader for the "messages" array: items are decoded one by one,
+    # so neither the raw file nor the whole JSON tree is kept in memory.
+    # Yields (message_data, bytes_read, file_size)
+    file_size = os.path.getsize(file_path)
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ""
+    bytes_read = 0
+    eof = False
+
+    with open(file_path, 'rb') as f:
+
+        def read_more():
+            nonlocal buffer, bytes_read, eof
+            chunk = f.read(chunk_size)
+            bytes_read += len(chunk)
+            if not chunk:
+                eof = True
+            buffer += text_decoder.decode(chunk, final=eof)
+
+        # Looking for the beginning of the array
+        position = None
+        while position is None:
+            match = MESSAGES_ARRAY_RE.search(buffer)
+            if match:
+                position = match.end()
+            elif eof:
+                return
             else:
-                message_data['main_date'] = None
-                message_data['month_date'] = None
-                message_data['year_date'] = None            
-            
-            # Progress Bat
-            progress = int((i + 1) / total_messages * 100)
-            progress_emitter.emit_progress(progress)
-
-
-
-        messages_data = correcting_export_names(messages_data)
-
-        return messages_data, directory
+                read_more()
+
+        while True:
+            # Skipping separators between items
+            while True:
+                while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                    position += 1
+                if position < len(buffer) or eof:
+                    break
+                read_more()
+
+            if position >= len(buffer) or buffer[position] == ']':
+                return
+
+            try:
+                message_data, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The item is not complete yet
+                if eof:
+                    raise
+                read_more()
+                continue
+
+            position = end
+            # Dropping the parsed part so the buffer stays about one chunk long
+            if position > chunk_size:
+                buffer = buffer[position:]
+                position = 0
+
+            yield message_data, bytes_read, file_size
+
+
+def set_message_dates(message_data, date_parser=None):
+    date_str = message_date_string(message_data)
+    if date_str:
+        message_data['main_date'], message_data['month_date'], message_data['year_date'] = parse_date_with_locale(date_str, date_parser)
+    else:
+        message_data['main_date'] = None
+        message_data['month_date'] = None
+        message_data['year_date'] = None
 
-# Correcting names accorfing Google artchive rules - files with the same name just getting numbers
 
-def correcting_export_names(messages_data):
+def message_date_string(message_data):
+    # The date used for the message
+    if 'created_date' in message_data:
+        return message_data['created_date']
+    return message_data.get('updated_date')
 
-    progress = 0
-    progress_emitter.emit_progress(progress)
 
+@profiler.profiled('load_json')
+def load_json(file_path, batch_callback=None, batch_size=500, should_stop=None):
+    # Main file loader
+    # batch_callback(messages_data) is called every batch_size messages, so the UI can draw before the end
+    # should_stop() is checked with every batch, the messages are None if it stopped
+    directory = os.path.dirname(file_path)
+    chat_data.main_dir = directory
+    # Attachments are listed before the first page is drawn
+    with profiler.span('load_json.attachments'):
+        get_attachment_manifest(directory)
+
+    # zero message for comfortable iteration
+    messages_data = MessageStore()
+    messages_data.append({})
     seen_names = {}
-    for i, message_data in enumerate(messages_data):
-        if 'attached_files' in message_data:
-            for attached_file in message_data['attached_files']:
-                export_name = attached_file.get('export_name')
-                if export_name:
-                    if export_name not in seen_names:
-                        seen_names[export_name] = 0
-                    else:
-                        seen_names[export_name] += 1
-                        base_name, ext = os.path.splitext(export_name)
-                        attached_file['export_name'] = f"{base_name}({seen_names[export_name]}){ext}"
-
-        progress = int((i + 1) / chat_data.total_messages * 100)
-        progress_emitter.emit_progress(progress)
-
-    return messages_data
+    settings = Settings()
+    locale_str = settings.get_locale()
+    date_parser = get_date_parser(locale_str)
+
+    # Big archives can parse dates in other processes while we keep reading the file
+    date_workers = settings.get_date_workers()
+    date_chunks = ParallelDateNormalizer(locale_str, date_workers) if date_workers > 1 else None
+    progress = ProgressTask('load', [('parse', 50), ('date-normalize', 50)] if date_chunks else [('parse', 100)])
+    progress.start_phase('parse', os.path.getsize(file_path))
+
+    # Numeration, date parsing and export names in one pass
+    try:
+        with profiler.span('load_json.parse', file=os.path.basename(file_path)) as span:
+            for message_data, bytes_read, file_size in iter_json_messages(file_path):
+                message_data['message_number'] = len(messages_data)
+                if date_chunks:
+                    date_chunks.add(message_data)
+                    message_data['main_date'] = None
+                else:
+                    set_message_dates(message_data, date_parser)
+                correct_message_export_names(message_data, seen_names)
+                messages_data.append(message_data)
+
+                if len(messages_data) % batch_size == 0:
+                    if should_stop and should_stop():
+                        if date_chunks:
+                            date_chunks.cancel()
+                        progress.finish()
+                        return None, directory
+                    chat_data.total_messages = len(messages_data)
+                    if batch_callback:
+                        batch_callback(messages_data)
+
+                progress.update(bytes_read)
+            span.args['messages'] = len(messages_data)
+    except BaseException:
+        # A broken file must not leave the date processes running
+        if date_chunks:
+            date_chunks.cancel()
+        progress.finish()
+        raise
+
+    # The last batch is not checked in the loop, a stop after it must not finish the loading
+    if should_stop and should_stop():
+        if date_chunks:
+            date_chunks.cancel()
+        progress.finish()
+        return None, directory
+    if date_chunks:
+        with profiler.span('load_json.date-normalize', workers=date_workers):
+            date_chunks.finish(messages_data, progress)
+        if should_stop and should_stop():
+            progress.finish()
+            return None, directory
+    with profiler.span('load_json.timeline'):
+        messages_data.build_timeline()
+
+    chat_data.total_messages = len(messages_data)
+    if batch_callback:
+        batch_callback(messages_data)
+    progress.finish()
+
+    return messages_data, directory
+
+
+def iter_loaded_messages(file_path, progress=None, phase='convert'):
+    # Messages with numbers, dates and export names one by one, without keeping them
+    seen_names = {}
+    date_parser = get_date_parser(Settings().get_locale())
+    if progress:
+        progress.start_phase(phase, os.path.getsize(file_path))
+
+    for number, (message_data, bytes_read, file_size) in enumerate(iter_json_messages(file_path), start=1):
+        message_data['message_number'] = number
+        set_message_dates(message_data, date_parser)
+        correct_message_export_names(message_data, seen_names)
+        if progress:
+            progress.update(bytes_read)
+
+        yield message_data
+
+
+def load_store(file_path, should_stop=None):
+    # SQLite mode: the file is converted on the first open, later opens only check the database
+    # should_stop() is checked with every batch of the conversion, the messages are None if it stopped
+    from archive_store import open_archive_store, StoredMessageList
+    directory = os.path.dirname(file_path)
+    chat_data.main_dir = directory
+    get_attachment_manifest(directory)
+
+    progress = ProgressTask('load', [('convert', 100)])
+    store = open_archive_store(file_path, Settings().get_locale(), lambda: iter_loaded_messages(file_path, progress),
+                               should_stop)
+    if store is None:
+        progress.finish()
+        return None, directory
+    messages_data = StoredMessageList(store)
+    chat_data.total_messages = len(messages_data)
+    progress.finish()
+
+    return messages_data, directory
+
+
+class ParallelDateNormalizer:
+    # Parses created_date/updated_date of the loaded messages in a process pool
+    # Messages are sent in chunks, the results are written back in the same order
+
+    def __init__(self, locale_str, workers, chunk_size=20000):
+        self.locale_str = locale_str
+        self.chunk_size = chunk_size
+        # Process pools are imported only for big archives
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+        # spawn: forking a process with running Qt threads is not safe
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        # Message numbers and date strings of the chunk
+        self.numbers = []
+        self.date_strings = []
+        self.futures = {}
+
+    def add(self, message_data):
+        self.numbers.append(message_data['message_number'])
+        self.date_strings.append(message_date_string(message_data))
+        if len(self.numbers) >= self.chunk_size:
+            self.submit()
+
+    def submit(self):
+        if self.numbers:
+            future = self.executor.submit(parse_timestamps, self.locale_str, self.date_strings)
+            self.futures[future] = self.numbers
+            self.numbers = []
+            self.date_strings = []
+
+    def finish(self, messages_data, progress=None):
+        # Merging the results back, chunks are the units of the date-normalize phase
+        from concurrent.futures import as_completed
+        self.submit()
+        total = len(self.futures)
+        if progress:
+            progress.start_phase('date-normalize', total)
+        try:
+            for done, future in enumerate(as_completed(self.futures), start=1):
+                numbers = self.futures[future]
+                for number, timestamp in zip(numbers, future.result()):
+                    messages_data.set_timestamp(number, timestamp)
+
+                if progress:
+                    progress.update(done)
+        finally:
+            self.futures = {}
+            self.executor.shutdown()
+
+    def cancel(self):
+        self.futures = {}
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
+# Correcting names accorfing Google artchive rules - files with the same name just getting numbers
 
+def correct_message_export_names(message_data, seen_names):
+    # seen_names keeps the counters between messages
+    if 'attached_files' in message_data:
+        for attached_file in message_data['attached_files']:
+            export_name = attached_file.get('export_name')
+            if export_name:
+                if export_name not in seen_names:
+                    seen_names[export_name] = 0
+                else:
+                    seen_names[export_name] += 1
+                    base_name, ext = os.path.splitext(export_name)
+                    attached_file['export_name'] = f"{base_name}({seen_names[export_name]}){ext}"
+
+
+@profiler.profiled('create_html_page')
 def create_html_page(text_browser_width, dir, messages_data, start_index, end_index):
     # Main function for building the page
+    # Messages that were on the screen recently come from the fragment cache
     first_message_name = chat_data.first_message_name
-    html = ""
-    half_width = text_browser_width / 2
+    fragments = []
+    # Width is rounded, so the cached fragments fit a slightly resized window
+    width_bucket = fragment_width(text_browser_width)
 
     # Checking borders
     if start_index < 1:
         start_index = 1
     if end_index > len(messages_data):
         end_index = len(messages_data)    
+
+    # Image sizes are read from file headers once and kept near the archive
+    image_sizes = get_image_size_cache(dir)
+    thumbnails = get_thumbnail_cache(dir) if Settings().get_thumbnails() else None
+    # Attachment files come from the listing made at load, the disk is not asked while scrolling
+    manifest = get_attachment_manifest(dir)
     
-    for i, message_data in enumerate(messages_data[start_index:end_index], start=start_index):
+    for message_data in messages_data[start_index:end_index]:
             name = message_data['creator']['name']
             if first_message_name:
                 pass
             else:
                 first_message_name = name        
                 chat_data.first_message_name = name        
-            message_number = message_data['message_number']
-            message_id = message_data['message_id']
-            created_date = message_data.get("updated_date", "")
-            if not created_date:
-                created_date = message_data.get("created_date", "")
-
-            # It can be non-text message but I want to have at least space
-            text = message_data.get('text', ' ')
-            text = text.replace("\n", "<br>") if len(text) > 1 else text
-            
-            # Style of message according the name
-            alignment = f"text-align: {'left' if name == first_message_name else 'right'}; {'margin-right' if name == first_message_name else 'margin-left'}:{half_width}px;"
-            
-            # Annotations checking
-            annotations = message_data.get("annotations", [])
-            if annotations:
-                annotation_html = annotation_parser(message_data)            
-                text = annotation_html
-
-            # Quotes
-            quoted_text = ""
-            quoted_message_metadata = message_data.get("quoted_message_metadata")
-            if quoted_message_metadata:
-                quoted_creator_name = quoted_message_metadata["creator"]["name"]
-                quoted_text = quoted_message_metadata["text"]
-                quoted_text = f"<i>From: {quoted_creator_name}:<br/>{quoted_text}<br/></i><br/>"            
-                
-                text = f"<div>{quoted_text}<br/>{text}<br/></div>"
-
-            # Thereis a main text message with ID (TextBrowser will change id ="" to <a name="">)
-            message_html = f"<div id='{message_number}' data-id='{message_id}' style='{alignment}'; -qt-block-indent:1;>{name}<br/>{created_date}<br/>{text}</div>"
-
-
-            # Working on pictures and other links and files
-            if 'attached_files' in message_data:
-                for attached_file in message_data['attached_files']:
-                    export_name = attached_file.get('export_name')
-                    if export_name.endswith(('.jpg', '.png', '.jpeg', '.gif')):
-                        img_path = os.path.join(dir, export_name)
-                        if os.path.exists(img_path):
-
-                            #image = cv2.imread(encoded_img_path)
-                            # CV2 cannot read non-latin filenames, so we are encoding this
-                            f = open(img_path, "rb")
-                            chunk = f.read()
-                            chunk_arr = np.frombuffer(chunk, dtype=np.uint8)
-                            image = cv2.imdecode(chunk_arr, cv2.IMREAD_COLOR)
-
-                            if image is not None:
-                                height_original, width_original, _ = image.shape
-                                width, height = resize_image(text_browser_width,width_original,height_original)
-                                img_url = QUrl.fromLocalFile(img_path).toString()
-                                # Sadly text browser doesnt support relative size so I need to use cv2 and text_browser_width to count the relative size in pixels
-                                img_html = f"<p><div style='text-align: {'left' if name == first_message_name else 'right'};'><a href='{img_url}' ><img src='{img_url}' width={width}  height={height} style='-qt-block-indent: 1;'/></a></div></p>"
-                                message_html += img_html
-                            if image is None and img_path is not None:
-                                img_url = QUrl.fromLocalFile(img_path).toString()
-                                # It also doesnt work with animated gifs so we have it as files only
-                                # Other files also can be download here
-                                img_html = f"<p style='text-align: {'left' if name == first_message_name else 'right'};'><a href='{img_url}'>(Open the file)</a></p>"
-                                message_html += img_html
-                        else:
-                            img_html = f"<p>No file {img_path} in {dir}</p>"
-                            message_html += img_html
-
-            message_html += "<br/><br/></div>"
-            html += message_html
-
-    return html
+
+            key = (message_data['message_number'], width_bucket, first_message_name, chat_data.font_size)
+            message_html = fragment_cache.get(key)
+            if message_html is None:
+                message_html = render_message(message_data, width_bucket, dir, first_message_name, image_sizes, thumbnails, manifest)
+                fragment_cache.put(key, message_html)
+            fragments.append(message_html)
+
+    # New sizes are saved when the loading ends, the chat is left or the window closes, not with every page
+    return "".join(fragments)
+
+
+def local_file_url(path):
+    return QUrl.fromLocalFile(path).toString()
+
+
+def render_message(message_data, text_browser_width, dir, first_message_name, image_sizes, thumbnails, manifest, file_url=local_file_url):
+    # HTML of one message
+    # file_url(path) - link to an attachment, the HTML export makes relative ones
+    name = message_data['creator']['name']
+    # Texts of the chat are plain text, a "<" in them must not become a tag
+    escaped_name = html.escape(name or '')
+    half_width = text_browser_width / 2
+    message_number = message_data['message_number']
+    message_id = message_data['message_id']
+    created_date = message_data.get("updated_date", "")
+    if not created_date:
+        created_date = message_data.get("created_date", "")
+
+    # It can be non-text message but I want to have at least space
+    text = message_data.get('text', ' ')
+    text = html.escape(text)
+    text = text.replace("\n", "<br>") if len(text) > 1 else text
+    
+    # Style of message according the name
+    alignment = f"text-align: {'left' if name == first_message_name else 'right'}; {'margin-right' if name == first_message_name else 'margin-left'}:{half_width}px;"
+    
+    # Annotations checking
+    annotations = message_data.get("annotations", [])
+    if annotations:
+        annotation_html = annotation_parser(message_data)            
+        text = annotation_html
+
+    # Quotes
+    quoted_text = ""
+    quoted_message_metadata = message_data.get("quoted_message_metadata")
+    if quoted_message_metadata:
+        quoted_creator_name = html.escape(quoted_message_metadata["creator"]["name"])
+        quoted_text = html.escape(quoted_message_metadata["text"]).replace("\n", "<br>")
+        quoted_text = f"<i>From: {quoted_creator_name}:<br/>{quoted_text}<br/></i><br/>"            
+        
+        text = f"<div>{quoted_text}<br/>{text}<br/></div>"
+
+    # Thereis a main text message with ID (TextBrowser will change id ="" to <a name="">)
+    # Found messages link to their place in the whole chat
+    original_number = message_data.get('original_number')
+    context_link = f" <a href='context:{original_number}'>(Show in chat)</a>" if original_number is not None else ""
+    message_html = f"<div id='{message_number}' data-id='{message_id}' style='{alignment}'; -qt-block-indent:1;>{escaped_name}<br/>{html.escape(created_date)}{context_link}<br/>{text}</div>"
+
+
+    # Working on pictures and other links and files
+    if 'attached_files' in message_data:
+        for attached_file in message_data['attached_files']:
+            export_name = attached_file.get('export_name')
+            if export_name.endswith(('.jpg', '.png', '.jpeg', '.gif')):
+                img_path = os.path.join(dir, export_name)
+                file_entry = manifest.get(export_name)
+                image_size = image_sizes.get(img_path, file_entry) if file_entry is not None else None
+                if image_size is not None:
+                    width_original, height_original, decodable = image_size
+
+                    if decodable:
+                        width, height = resize_image(text_browser_width,width_original,height_original)
+                        img_url = file_url(img_path)
+                        # The page shows a small copy, the link opens the original
+                        thumbnail_url = thumbnails.image_url(img_path, width, width_original) if thumbnails else img_url
+                        # Sadly text browser doesnt support relative size so I need to know the image size and text_browser_width to count the relative size in pixels
+                        img_html = f"<p><div style='text-align: {'left' if name == first_message_name else 'right'};'><a href='{img_url}' ><img src='{thumbnail_url}' width={width}  height={height} style='-qt-block-indent: 1;'/></a></div></p>"
+                        message_html += img_html
+                    else:
+                        img_url = file_url(img_path)
+                        # It also doesnt work with animated gifs so we have it as files only
+                        # Other files also can be download here
+                        img_html = f"<p style='text-align: {'left' if name == first_message_name else 'right'};'><a href='{img_url}'>(Open the file)</a></p>"
+                        message_html += img_html
+                else:
+                    img_html = f"<p>No file {html.escape(img_path)} in {html.escape(dir)}</p>"
+                    message_html += img_html
+
+    message_html += "<br/><br/></div>"
+    return message_html
 
 
 def annotation_parser(message_data):
@@ -234,7 +462,7 @@ def annotation_parser(message_data):
     text = message_data.get("text", "")
     annotations = message_data.get("annotations", [])
     
-    formatted_text = text.replace("\n", "<br>")
+    formatted_text = html.escape(text).replace("\n", "<br>")
     
     if annotations:
         for annotation in annotations:
@@ -244,19 +472,19 @@ def annotation_parser(message_data):
             
             preceding_text = text[start_index:start_index+length]
             
-            preceding_text = preceding_text.replace("\n", "<br>")
+            preceding_text = html.escape(preceding_text).replace("\n", "<br>")
             
             html_output += f"<p>Text link: {preceding_text}</p>"
             
-            title = url_metadata.get("title", "")
+            title = html.escape(url_metadata.get("title", ""))
             if title:
                 html_output += f"<p><strong>{title}</strong></p>"
 
-            snippet = url_metadata.get("snippet", "")
+            snippet = html.escape(url_metadata.get("snippet", ""))
             if snippet:
                 html_output += f"<p><i>{snippet}</i></p>"     
 
-            image_url = url_metadata.get("image_url", "")
+            image_url = html.escape(url_metadata.get("image_url", ""))
             if image_url:
                 # We can download the image and put into the browser and I have an option in Settings but I didnt want to work on it
                 #html_output += f'<a href="{image_url}"><img src="{image_url}" alt="Image"></a>'
@@ -265,7 +493,7 @@ def annotation_parser(message_data):
                 if title:
                     html_output += "<br>"
                 
-            material_url = url_metadata.get("url", {}).get("private_do_not_access_or_else_safe_url_wrapped_value", "")
+            material_url = html.escape(url_metadata.get("url", {}).get("private_do_not_access_or_else_safe_url_wrapped_value", ""))
             if material_url:
                 if image_url:
                     html_output += "<br>"
@@ -278,8 +506,8 @@ def annotation_parser(message_data):
 def resize_image(browser_width, img_width, img_height):
     # New image size is the browser window will resize
 
-    if img_width> (browser_width // 3):
-        new_width = browser_width // 3
+    if img_width > picture_width(browser_width):
+        new_width = picture_width(browser_width)
         new_height = int(new_width * img_height / img_width)
     
     else:
@@ -2,6 +2,8 @@ import configparser
 import sys
 import os
 import shutil
+import threading
+import time
 
 def resource_path(relative_path):
     """ Get absolute path to resource, works for dev and for PyInstaller """
@@ -30,31 +32,124 @@ def check_config_file():
 # There are classes to keep data
 
 class Settings:
-    def __init__(self):
-        check_config_file()
-        self._config = configparser.ConfigParser()
-        self._config.read(resource_path('config.ini'), encoding='utf-8')
+    # One object for the whole process: config.ini is checked and read once,
+    # later it is read again only if the file was changed or after reload()
+
+    _instance = None
+    _lock = threading.RLock()
+    # Seconds between mtime checks
+    check_interval = 1.0
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    instance = super().__new__(cls)
+                    check_config_file()
+                    instance._load()
+                    cls._instance = instance
+        return cls._instance
+
+    def _load(self):
+        # The new parser replaces the old one at once, so other threads never see a half-read file
+        path = resource_path('config.ini')
+        config = configparser.ConfigParser()
+        config.read(path, encoding='utf-8')
+        self._mtime = self._file_mtime(path)
+        self._checked = time.monotonic()
+        self._config = config
+
+    @staticmethod
+    def _file_mtime(path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+    @property
+    def config(self):
+        # Parser with the actual file content
+        if time.monotonic() - self._checked > self.check_interval:
+            with self._lock:
+                self._checked = time.monotonic()
+                if self._file_mtime(resource_path('config.ini')) != self._mtime:
+                    self._load()
+        return self._config
+
+    def reload(self):
+        with self._lock:
+            check_config_file()
+            self._load()
 
     def get_locale(self):
-        return self._config.get('settings', 'locale')
+        return self.config.get('settings', 'locale')
 
     def get_external_pictures(self):
-        return self._config.getboolean('settings', 'external_pictures', fallback=False)
+        return self.config.getboolean('settings', 'external_pictures', fallback=False)
     
     def get_first_name(self):
-        return self._config.get('settings', 'first_name', fallback=None)    
+        return self.config.get('settings', 'first_name', fallback=None)    
+
+    def get_date_workers(self):
+        # Processes for date parsing, 0 or 1 means parsing in the loading thread
+        return self.config.getint('settings', 'date_workers', fallback=0)
+
+    def get_fragment_cache_mb(self):
+        # Memory for rendered messages
+        return self.config.getint('settings', 'fragment_cache_mb', fallback=64)
+
+    def get_image_cache_mb(self):
+        # Memory for decoded pictures of the pages
+        return self.config.getint('settings', 'image_cache_mb', fallback=128)
+
+    def get_chat_view(self):
+        # "browser" - text browser with the window of 100 messages, "list" - virtualized list of all messages
+        return self.config.get('settings', 'chat_view', fallback='browser')
+
+    def get_incremental_scroll(self):
+        # Scrolling adds and removes 50 messages instead of building the whole page again
+        return self.config.getboolean('settings', 'incremental_scroll', fallback=True)
+
+    def get_storage(self):
+        # "json" - messages.json is read on every open, "sqlite" - converted once into a database near it
+        return self.config.get('settings', 'storage', fallback='json')
+
+    def get_thumbnails(self):
+        # Small copies of pictures instead of the originals
+        return self.config.getboolean('settings', 'thumbnails', fallback=True)
+
+    def get_progress_rate(self):
+        # Progress bar updates per second at most
+        return self.config.getint('settings', 'progress_rate', fallback=10)
+
+    def get_profiling(self):
+        # Timing of load, render and scroll stages, Ctrl+Shift+P shows it, read at start
+        return self.config.getboolean('settings', 'profiling', fallback=False)
+
+    def get_catalog_workers(self):
+        # Threads reading the chats of a Takeout folder for its list
+        return self.config.getint('settings', 'catalog_workers', fallback=4)
+
+    def get_chat_cache_size(self):
+        # Loaded chats of a Takeout kept in memory besides the open one
+        return self.config.getint('settings', 'chat_cache_size', fallback=5)
+
+    def get_export_workers(self):
+        # Threads rendering the pages of the HTML export, 0 or 1 means rendering in the exporting thread
+        return self.config.getint('settings', 'export_workers', fallback=4)
 
     def set_locale(self, locale):
-        self._config.set('settings', 'locale', locale)
-        with open('config.ini', 'w') as configfile:
-            self._config.write(configfile)
+        with self._lock:
+            self._config.set('settings', 'locale', locale)
+            with open('config.ini', 'w') as configfile:
+                self._config.write(configfile)
 
 class ChatData:
 
 
     _instance = None
 
-    def __new__(cls, total_messages=0, text_browser_width=0, date_structure = None, first_message_name=None, start_message=1, end_message=50, main_dir = None, messages_list = None, original_messages_list = None, lastMessageFlag = False, searchingFlag = False):
+    def __new__(cls, total_messages=0, text_browser_width=0, date_structure = None, first_message_name=None, start_message=1, end_message=50, main_dir = None, messages_list = None, original_messages_list = None, lastMessageFlag = False, searchingFlag = False, font_size = 14, search_index = None, field_index = None):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
             cls._instance.total_messages = total_messages
@@ -68,7 +163,10 @@ class ChatData:
             cls._instance.original_messages_list = original_messages_list
             cls._instance.searchingFlag = searchingFlag
             cls._instance.lastMessageFlag = lastMessageFlag
+            cls._instance.font_size = font_size
+            cls._instance.search_index = search_index
+            cls._instance.field_index = field_index
         return cls._instance
 
-first_name = Settings().get_first_name()
-chat_data = ChatData(first_message_name=first_name)
+# first_message_name comes from config.ini when an archive is opened, nothing is read at import
+chat_data = ChatData()
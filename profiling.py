@@ -0,0 +1,121 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from messages_model import Settings
+
+# GCV_PROFILE=1 turns profiling on without changing config.ini
+PROFILE_ENV = 'GCV_PROFILE'
+
+
+class Span:
+    # One timed stage, args can be filled in while it runs
+
+    __slots__ = ('profiler', 'name', 'args', 'started')
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, self.started, time.perf_counter(), self.args)
+
+
+class NoSpan:
+    # Used when profiling is off, costs one call
+
+    @property
+    def args(self):
+        return {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+_no_span = NoSpan()
+
+
+class Profiler:
+    # Spans of load, render and scroll stages kept in memory, the oldest are dropped
+    # Off by default: profiling = True in config.ini or GCV_PROFILE=1
+
+    def __init__(self, max_events=200000):
+        self._enabled = None
+        self.events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        # Read on the first span, so importing the module reads no settings
+        if self._enabled is None:
+            self._enabled = os.environ.get(PROFILE_ENV, '') not in ('', '0') or Settings().get_profiling()
+        return self._enabled
+
+    def span(self, name, **args):
+        # with profiler.span('create_html_page', messages=50): ...
+        if not self.enabled:
+            return _no_span
+        return Span(self, name, args)
+
+    def profiled(self, name):
+        # Decorator, costs one check per call when profiling is off
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with Span(self, name, {}):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record(self, name, started, finished, args):
+        event = (name, threading.get_ident(), started, finished - started, dict(args))
+        with self._lock:
+            self.events.append(event)
+
+    def clear(self):
+        with self._lock:
+            self.events.clear()
+
+    def stats(self):
+        # [(name, count, total seconds, mean seconds, max seconds)], the longest total first
+        totals = {}
+        with self._lock:
+            events = list(self.events)
+        for name, _, _, duration, _ in events:
+            count, total, longest = totals.get(name, (0, 0.0, 0.0))
+            totals[name] = (count + 1, total + duration, max(longest, duration))
+        rows = [(name, count, total, total / count, longest) for name, (count, total, longest) in totals.items()]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows
+
+    def chrome_trace(self):
+        # Trace Event Format, opens in chrome://tracing and Perfetto
+        with self._lock:
+            events = list(self.events)
+        pid = os.getpid()
+        origin = min((event[2] for event in events), default=0)
+        trace_events = [{'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                         'ts': round((started - origin) * 1e6, 1), 'dur': round(duration * 1e6, 1), 'args': args}
+                        for name, tid, started, duration, args in events]
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for tid in {event['tid'] for event in trace_events}:
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                                 'args': {'name': thread_names.get(tid, str(tid))}})
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def export_chrome_trace(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f)
+
+profiler = Profiler()
@@ -0,0 +1,60 @@
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, QPushButton, QFileDialog, QHeaderView, QLabel
+from PyQt5.QtCore import Qt
+from profiling import profiler
+
+
+class ProfilingDialog(QDialog):
+    # Totals of the recorded spans, the trace can be saved for a bug report
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Profiling")
+        self.resize(700, 400)
+
+        layout = QVBoxLayout(self)
+        self.label = QLabel()
+        layout.addWidget(self.label)
+
+        self.table = QTableWidget(0, 5)
+        self.table.setHorizontalHeaderLabels(["Stage", "Count", "Total, ms", "Mean, ms", "Max, ms"])
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setSortingEnabled(True)
+        layout.addWidget(self.table)
+
+        buttons = QHBoxLayout()
+        for title, slot in (("Refresh", self.refresh), ("Clear", self.clear), ("Export trace...", self.export_trace), ("Close", self.close)):
+            button = QPushButton(title)
+            button.clicked.connect(slot)
+            buttons.addWidget(button)
+        layout.addLayout(buttons)
+
+        self.refresh()
+
+    def refresh(self):
+        if profiler.enabled:
+            self.label.setText(f"{len(profiler.events)} spans")
+        else:
+            self.label.setText("Profiling is off: set profiling = True in config.ini or GCV_PROFILE=1")
+
+        rows = profiler.stats()
+        self.table.setSortingEnabled(False)
+        self.table.setRowCount(len(rows))
+        for row, (name, count, total, mean, longest) in enumerate(rows):
+            self.table.setItem(row, 0, QTableWidgetItem(name))
+            for column, value in enumerate((count, total * 1000, mean * 1000, longest * 1000), start=1):
+                item = QTableWidgetItem()
+                # Numbers sort as numbers
+                item.setData(Qt.DisplayRole, value if column == 1 else round(value, 2))
+                item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(row, column, item)
+        self.table.setSortingEnabled(True)
+
+    def clear(self):
+        profiler.clear()
+        self.refresh()
+
+    def export_trace(self):
+        fname, _ = QFileDialog.getSaveFileName(self, 'Save trace', 'gcv_trace.json', "Trace files (*.json)")
+        if fname:
+            profiler.export_chrome_trace(fname)
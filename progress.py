@@ -0,0 +1,85 @@
+import time
+from PyQt5.QtCore import QObject, pyqtSignal
+from messages_model import Settings
+
+# Phase names shown in the status bar
+PHASE_TITLES = {
+    'parse': 'Reading messages',
+    'date-normalize': 'Parsing dates',
+    'convert': 'Converting the archive',
+    'index': 'Indexing',
+    'fields': 'Indexing senders and files',
+    'search': 'Searching',
+    'catalog': 'Reading the chats',
+    'export': 'Exporting HTML',
+}
+
+
+class ProgressEmitter(QObject):
+    # Phase name, percent of the whole task, seconds left (-1 while unknown)
+    progress_changed = pyqtSignal(str, int, float)
+    # Task name, sent once when the task is done
+    progress_finished = pyqtSignal(str)
+
+progress_emitter = ProgressEmitter()
+
+
+class ProgressTask:
+    # Progress of one task made of weighted phases, e.g. [('parse', 50), ('date-normalize', 50)]
+    # update() can be called for every message, signals go out at most max_rate times a second
+    # and only when the percent has changed
+
+    def __init__(self, name, phases, max_rate=None):
+        self.name = name
+        self.weights = dict(phases)
+        self.order = [phase for phase, _ in phases]
+        self.total_weight = sum(self.weights.values()) or 1
+        if max_rate is None:
+            max_rate = Settings().get_progress_rate()
+        self.interval = 1 / max_rate if max_rate > 0 else 0
+        self.started = time.monotonic()
+        self.phase = None
+        self.phase_total = 0
+        # Weight of the finished phases
+        self.done_weight = 0
+        self.last_emit = 0
+        self.last_percent = -1
+        # Cheap check for calls between the updates
+        self.next_done = 0
+        self.step = 1
+
+    def start_phase(self, phase, total):
+        if self.phase is not None:
+            self.done_weight += self.weights.get(self.phase, 0)
+        self.phase = phase
+        self.phase_total = total
+        # About 200 checks of the clock per phase
+        self.step = max(1, total // 200)
+        self.next_done = 0
+        self.emit(0, time.monotonic(), force=True)
+
+    def update(self, done, total=None):
+        if total is not None and total != self.phase_total:
+            self.phase_total = total
+            self.step = max(1, total // 200)
+        if done < self.next_done:
+            return
+        self.next_done = done + self.step
+        now = time.monotonic()
+        if now - self.last_emit >= self.interval:
+            self.emit(done, now)
+
+    def emit(self, done, now, force=False):
+        phase_part = min(done / self.phase_total, 1) if self.phase_total else 0
+        fraction = (self.done_weight + self.weights.get(self.phase, 0) * phase_part) / self.total_weight
+        percent = min(int(fraction * 100), 99)
+        if percent == self.last_percent and not force:
+            return
+        elapsed = now - self.started
+        eta = elapsed * (1 - fraction) / fraction if fraction > 0.01 else -1
+        self.last_emit = now
+        self.last_percent = percent
+        progress_emitter.progress_changed.emit(self.phase or '', percent, eta)
+
+    def finish(self):
+        progress_emitter.progress_finished.emit(self.name)
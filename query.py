@@ -0,0 +1,231 @@
+import datetime
+import re
+from array import array
+from search_index import contains_sorted
+from profiling import profiler
+from timeline import month_start_timestamp, next_month_timestamp
+from message_store import file_extension, has_link
+
+# Pictures like in the page renderer
+IMAGE_EXTENSIONS = ('.jpg', '.png', '.jpeg', '.gif')
+HAS_VALUES = ('attachment', 'image', 'link')
+# key:value or key:"some words"
+FIELD_RE = re.compile(r'(?<!\S)(from|after|before|date|has|ext):(?:"([^"]*)"|(\S+))', re.IGNORECASE)
+
+
+class SearchQuery:
+    # Text of the search box split into the text part and the field filters:
+    #   from:Alice  from:"Alice Smith"     sender name contains the value
+    #   date:2023-03  date:2023  date:2023-03-15
+    #   after:2023-03-01  before:2023-04-01   (after is inclusive, before is not)
+    #   has:image  has:attachment  has:link
+    #   ext:pdf
+    # Everything else is searched in the text as before
+
+    def __init__(self, source):
+        self.source = source
+        self.text = ''
+        self.senders = []
+        self.start_timestamp = None
+        self.end_timestamp = None
+        self.has = set()
+        self.extensions = set()
+
+    def has_filters(self):
+        return bool(self.senders or self.start_timestamp is not None or self.end_timestamp is not None
+                    or self.has or self.extensions)
+
+    def narrow(self, start_timestamp, end_timestamp):
+        if start_timestamp is not None and (self.start_timestamp is None or start_timestamp > self.start_timestamp):
+            self.start_timestamp = start_timestamp
+        if end_timestamp is not None and (self.end_timestamp is None or end_timestamp < self.end_timestamp):
+            self.end_timestamp = end_timestamp
+
+    def matches(self, messages_data, i):
+        # Checking one message without indexes
+        if self.text and self.text.lower() not in messages_data.text(i).lower():
+            return False
+        if self.senders:
+            name = (messages_data.creator_name(i) or '').lower()
+            if not any(sender in name for sender in self.senders):
+                return False
+        if self.start_timestamp is not None or self.end_timestamp is not None:
+            timestamp = messages_data.timestamp(i)
+            if timestamp is None:
+                return False
+            if self.start_timestamp is not None and timestamp < self.start_timestamp:
+                return False
+            if self.end_timestamp is not None and timestamp >= self.end_timestamp:
+                return False
+        if self.has or self.extensions:
+            features = column_features(messages_data, i)
+            if not self.has <= features['has'] or not self.extensions <= features['extensions']:
+                return False
+        return True
+
+
+def parse_day(value, key):
+    # (start, end) timestamps of 2023, 2023-03 or 2023-03-15
+    try:
+        parts = [int(part) for part in value.split('-')]
+        if len(parts) == 1:
+            return month_start_timestamp(parts[0], 1), month_start_timestamp(parts[0] + 1, 1)
+        if len(parts) == 2:
+            return month_start_timestamp(parts[0], parts[1]), next_month_timestamp(parts[0], parts[1])
+        if len(parts) == 3:
+            day = datetime.datetime(parts[0], parts[1], parts[2], tzinfo=datetime.timezone.utc)
+            return int(day.timestamp()), int((day + datetime.timedelta(days=1)).timestamp())
+    except ValueError:
+        pass
+    raise ValueError(f"{key}: wants a date like 2023, 2023-03 or 2023-03-15, not '{value}'")
+
+
+def parse_query(source):
+    # ValueError with a readable message for wrong values
+    search_query = SearchQuery(source)
+
+    for match in FIELD_RE.finditer(source):
+        key = match.group(1).lower()
+        value = match.group(2) if match.group(2) is not None else match.group(3)
+        if key == 'from':
+            search_query.senders.append(value.lower())
+        elif key in ('date', 'after', 'before'):
+            start, end = parse_day(value, key)
+            # Several dates narrow the range
+            if key in ('date', 'after'):
+                search_query.narrow(start, None)
+            if key == 'date':
+                search_query.narrow(None, end)
+            if key == 'before':
+                search_query.narrow(None, start)
+        elif key == 'has':
+            if value.lower() not in HAS_VALUES:
+                raise ValueError(f"has: can be {', '.join(HAS_VALUES)}, not '{value}'")
+            search_query.has.add(value.lower())
+        elif key == 'ext':
+            search_query.extensions.add(value.lower().lstrip('.'))
+
+    # Without fields the text stays exactly as it was typed
+    search_query.text = text_without_fields(source) if search_query.has_filters() else source
+    return search_query
+
+
+def text_without_fields(source):
+    # Words around the fields as they were typed, a field between them leaves one space
+    pieces = FIELD_RE.split(source)[::FIELD_RE.groups + 1]
+    return ' '.join(piece.strip() for piece in pieces if piece.strip())
+
+
+def features(attachment_extensions, link):
+    # {'has': {'attachment', 'image', 'link'}, 'extensions': {'jpg', ...}} of one message
+    has = set()
+    extensions = set()
+    for extension in attachment_extensions:
+        has.add('attachment')
+        if extension:
+            extensions.add(extension)
+            if '.' + extension in IMAGE_EXTENSIONS:
+                has.add('image')
+    if link:
+        has.add('link')
+    return {'has': has, 'extensions': extensions}
+
+
+def message_features(message_data):
+    # Features of a message dict
+    return features([file_extension(attached_file.get('export_name'))
+                     for attached_file in message_data.get('attached_files', ())], has_link(message_data))
+
+
+def column_features(messages_data, i):
+    # Features from the columns of the list, the message is not decoded
+    return features(messages_data.attachment_extensions(i), messages_data.has_link(i))
+
+
+class FieldIndex:
+    # Sorted message positions by sender, attachment extension and has:attachment/image/link
+    # Dates are looked up in the timeline of the list
+
+    def __init__(self):
+        self.creators = {}
+        self.extensions = {}
+        self.has = {}
+
+    @profiler.profiled('field_index.build')
+    def build(self, messages_data, should_stop=None, progress_callback=None):
+        # Returns False if it was stopped
+        total = len(messages_data)
+        for i in range(1, total):
+            name = messages_data.creator_name(i)
+            if name:
+                self._add(self.creators, name.lower(), i)
+            if messages_data.attachment_count(i) or messages_data.has_link(i):
+                found = column_features(messages_data, i)
+                for value in found['has']:
+                    self._add(self.has, value, i)
+                for extension in found['extensions']:
+                    self._add(self.extensions, extension, i)
+
+            if i % 10000 == 0:
+                if should_stop and should_stop():
+                    return False
+                if progress_callback:
+                    progress_callback(i, total)
+        return True
+
+    @staticmethod
+    def _add(postings, key, i):
+        posting = postings.get(key)
+        if posting is None:
+            posting = postings[key] = array('I')
+        posting.append(i)
+
+    def creator_positions(self, senders):
+        # Messages of every sender whose name contains one of the values
+        lists = [posting for name, posting in self.creators.items() if any(sender in name for sender in senders)]
+        if len(lists) == 1:
+            return lists[0]
+        return sorted(i for posting in lists for i in posting)
+
+
+def plan_query(search_query, messages_data, field_index, search_index=None, timeline=None):
+    # Sorted positions of the matching messages
+    # Every filter gives a sorted list, the shortest one is walked and the others are checked with bisect
+    posting_lists = []
+    if search_query.senders:
+        posting_lists.append(field_index.creator_positions(search_query.senders))
+    if search_query.start_timestamp is not None or search_query.end_timestamp is not None:
+        if timeline is None:
+            timeline = messages_data.build_timeline()
+        posting_lists.append(timeline.positions_between(search_query.start_timestamp, search_query.end_timestamp))
+    for value in search_query.has:
+        posting_lists.append(field_index.has.get(value, ()))
+    for extension in search_query.extensions:
+        posting_lists.append(field_index.extensions.get(extension, ()))
+    if search_query.text and search_index is not None:
+        # Trigram candidates only when they are cheaper than checking the text of the other lists
+        cost = search_index.candidates_cost(search_query.text)
+        if posting_lists:
+            use_trigrams = cost is not None and cost < min(len(posting) for posting in posting_lists)
+        else:
+            # A word that is in most messages is found faster by reading them
+            use_trigrams = cost is not None and cost < len(messages_data) // 4
+        if use_trigrams:
+            posting_lists.append(search_index.candidates(search_query.text))
+
+    if not posting_lists:
+        # Plain text without the trigram index
+        return (i for i in range(1, len(messages_data)) if search_query.matches(messages_data, i))
+
+    posting_lists.sort(key=len)
+    result = posting_lists[0]
+    for posting in posting_lists[1:]:
+        if not result:
+            break
+        result = [i for i in result if contains_sorted(posting, i)]
+
+    # Candidates of the trigram index are checked against the real text
+    text = search_query.text.lower()
+    if text:
+        return (i for i in result if text in messages_data.text(i).lower())
+    return iter(result)
@@ -0,0 +1,102 @@
+from array import array
+from bisect import bisect_left
+from profiling import profiler
+
+# Length of the indexed pieces of text
+GRAM = 3
+
+
+def contains_sorted(values, value):
+    # values is a sorted array
+    i = bisect_left(values, value)
+    return i < len(values) and values[i] == value
+
+
+class TrigramIndex:
+    # Inverted index of the lowercased message texts: trigram -> sorted message positions
+    # A query of any length gives candidates from the posting lists, then they are checked
+
+    def __init__(self):
+        self.postings = {}
+        # Texts shorter than a trigram
+        self.short_texts = array('I')
+        self.indexed = 0
+
+    @profiler.profiled('search_index.build')
+    def build(self, messages_data, should_stop=None, progress_callback=None):
+        # Returns False if it was stopped
+        postings = self.postings
+        total = len(messages_data)
+        for i in range(total):
+            text = messages_data.text(i)
+            if text:
+                text = text.lower()
+                if len(text) < GRAM:
+                    self.short_texts.append(i)
+                else:
+                    for gram in {text[j:j + GRAM] for j in range(len(text) - GRAM + 1)}:
+                        posting = postings.get(gram)
+                        if posting is None:
+                            posting = postings[gram] = array('I')
+                        posting.append(i)
+
+            if i % 10000 == 0:
+                if should_stop and should_stop():
+                    return False
+                if progress_callback:
+                    progress_callback(i, total)
+
+        self.indexed = total
+        return True
+
+    def candidates(self, query):
+        # Sorted positions of messages that can contain the query
+        query = query.lower()
+        if not query:
+            return []
+
+        if len(query) >= GRAM:
+            grams = {query[j:j + GRAM] for j in range(len(query) - GRAM + 1)}
+            posting_lists = []
+            for gram in grams:
+                posting = self.postings.get(gram)
+                if posting is None:
+                    return []
+                posting_lists.append(posting)
+
+            # The shortest list first, the others are only checked with bisect
+            posting_lists.sort(key=len)
+            result = posting_lists[0]
+            for posting in posting_lists[1:]:
+                result = [i for i in result if contains_sorted(posting, i)]
+                if not result:
+                    break
+            return list(result)
+
+        # Short query: every place of it in a text is inside some trigram of that text
+        found = set(self.short_texts)
+        for gram, posting in self.postings.items():
+            if query in gram:
+                found.update(posting)
+        return sorted(found)
+
+    def candidates_cost(self, query):
+        # Length of the list that candidates() walks
+        query = query.lower()
+        if not query:
+            return None
+        if len(query) < GRAM:
+            # Short queries join the lists of all trigrams with them, the keys are looked through without the lists
+            return len(self.short_texts) + sum(len(posting) for gram, posting in self.postings.items() if query in gram)
+        lengths = [len(self.postings.get(query[j:j + GRAM], ())) for j in range(len(query) - GRAM + 1)]
+        return min(lengths)
+
+    def iter_search(self, messages_data, query):
+        # Positions of messages with the query in the text, checked one by one
+        query = query.lower()
+        for i in self.candidates(query):
+            if query in messages_data.text(i).lower():
+                yield i
+
+    def search(self, messages_data, query):
+        return list(self.iter_search(messages_data, query))
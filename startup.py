@@ -0,0 +1,37 @@
+import json
+import os
+import sys
+import time
+
+# Imported first by main_form, so the times start before the heavy modules
+STARTED = time.perf_counter()
+
+
+class StartupTimer:
+    # Time from the start of main_form to the shown window, split into stages
+
+    def __init__(self):
+        self.marks = [('start', STARTED)]
+
+    def mark(self, stage):
+        # The time since the previous mark goes to this stage
+        self.marks.append((stage, time.perf_counter()))
+
+    def report(self):
+        stages = {stage: round((finished - started) * 1000, 1)
+                  for (_, started), (stage, finished) in zip(self.marks, self.marks[1:])}
+        return {'total_ms': round((self.marks[-1][1] - STARTED) * 1000, 1), 'stages_ms': stages,
+                'frozen': bool(getattr(sys, 'frozen', False)), 'pid': os.getpid()}
+
+    def record(self, profiler):
+        # Stages as profiling spans, they are shown in the dialog and in the trace
+        if profiler.enabled:
+            for (_, started), (stage, finished) in zip(self.marks, self.marks[1:]):
+                profiler.record('startup.' + stage, started, finished, {})
+
+    def save(self, path):
+        # One JSON line per start, the history shows regressions
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(dict(self.report(), time=time.strftime('%Y-%m-%d %H:%M:%S'))) + '\n')
+
+startup_timer = StartupTimer()
@@ -0,0 +1,244 @@
+import datetime
+import json
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from messages_model import Settings
+from date_parser import get_date_parser
+from progress import ProgressTask
+from profiling import profiler
+
+# A chat of the Takeout is a folder with messages.json, its attachments lie near it
+CHAT_FILE_NAME = 'messages.json'
+GROUP_INFO_FILE_NAME = 'group_info.json'
+# The last catalog in the Takeout root, unchanged chats are not read again
+CATALOG_FILE_NAME = '.gcv_catalog.json'
+# Chat folders are not deeper than Takeout/Google Chat/Groups/<chat>
+MAX_DEPTH = 4
+CREATED_DATE_KEY = b'"created_date"'
+CREATED_DATE_RE = re.compile(rb'"created_date"\s*:\s*"((?:[^"\\]|\\.)*)"')
+# The last date is looked for in this many bytes at the end of the file
+TAIL_SIZE = 1 << 16
+
+
+class ChatEntry:
+    # One chat of the catalog, described without parsing its messages
+
+    def __init__(self, path, name, message_count=0, first_timestamp=None, last_timestamp=None, size=0, mtime=0.0):
+        self.path = path
+        self.name = name
+        self.message_count = message_count
+        self.first_timestamp = first_timestamp
+        self.last_timestamp = last_timestamp
+        self.size = size
+        self.mtime = mtime
+
+    def is_fresh(self, stat):
+        return self.size == stat.st_size and self.mtime == stat.st_mtime
+
+    def to_dict(self, root):
+        # Paths are kept relative, so a moved Takeout keeps its catalog
+        return {'path': os.path.relpath(self.path, root), 'name': self.name, 'message_count': self.message_count,
+                'first_timestamp': self.first_timestamp, 'last_timestamp': self.last_timestamp,
+                'size': self.size, 'mtime': self.mtime}
+
+    @classmethod
+    def from_dict(cls, root, data):
+        return cls(os.path.join(root, data['path']), data['name'], data['message_count'], data['first_timestamp'],
+                   data['last_timestamp'], data['size'], data['mtime'])
+
+
+def find_chat_files(root, max_depth=MAX_DEPTH):
+    # messages.json files under the root, a chat folder is not entered - it only has attachments
+    found = []
+    folders = [(root, 0)]
+    while folders:
+        folder, depth = folders.pop()
+        try:
+            entries = list(os.scandir(folder))
+        except OSError:
+            continue
+        if any(entry.name == CHAT_FILE_NAME and entry.is_file() for entry in entries):
+            found.append(os.path.join(folder, CHAT_FILE_NAME))
+        elif depth < max_depth:
+            folders.extend((entry.path, depth + 1) for entry in entries
+                           if entry.is_dir() and not entry.name.startswith('.'))
+    return sorted(found)
+
+
+def chat_name(folder):
+    # Space name or the members of a direct message, the folder name without group_info.json
+    try:
+        with open(os.path.join(folder, GROUP_INFO_FILE_NAME), encoding='utf-8') as f:
+            group_info = json.load(f)
+    except (OSError, ValueError):
+        return os.path.basename(folder)
+
+    if group_info.get('name'):
+        return group_info['name']
+    first_name = Settings().get_first_name()
+    names = [member['name'] for member in group_info.get('members', [])
+             if member.get('name') and member['name'] != first_name]
+    return ', '.join(names) or os.path.basename(folder)
+
+
+def date_timestamp(raw_date, date_parser):
+    try:
+        dt_object, _, _ = date_parser.parse(json.loads(b'"' + raw_date + b'"'))
+    except Exception:
+        # A date in another locale leaves the span empty, the chat still opens
+        return None
+    return int(dt_object.timestamp())
+
+
+def scan_chat(path, date_parser, chunk_size=1 << 20):
+    # The raw file is read in chunks: messages are counted by their "created_date" keys,
+    # the dates of the first and the last ones are parsed
+    stat = os.stat(path)
+    message_count = 0
+    first_date = None
+    tail = b''
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            data = tail + chunk
+            message_count += data.count(CREATED_DATE_KEY)
+            if first_date is None:
+                match = CREATED_DATE_RE.search(data)
+                if match:
+                    first_date = match.group(1)
+            # The tail is shorter than the key, so a key cut between chunks is counted once
+            tail = data[-(len(CREATED_DATE_KEY) - 1):]
+
+        f.seek(max(stat.st_size - TAIL_SIZE, 0))
+        matches = CREATED_DATE_RE.findall(f.read())
+        last_date = matches[-1] if matches else first_date
+
+    return ChatEntry(path, chat_name(os.path.dirname(path)), message_count,
+                     date_timestamp(first_date, date_parser) if first_date else None,
+                     date_timestamp(last_date, date_parser) if last_date else None,
+                     stat.st_size, stat.st_mtime)
+
+
+def date_span_text(first_timestamp, last_timestamp):
+    # "2020-03 - 2021-11" for the list of chats
+    months = [datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m')
+              for timestamp in (first_timestamp, last_timestamp) if timestamp is not None]
+    if not months:
+        return ''
+    if months[0] == months[-1]:
+        return months[0]
+    return f"{months[0]} - {months[-1]}"
+
+
+def load_catalog(root):
+    # path -> ChatEntry of the previous scan
+    try:
+        with open(os.path.join(root, CATALOG_FILE_NAME), encoding='utf-8') as f:
+            entries = [ChatEntry.from_dict(root, data) for data in json.load(f)]
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+    return {entry.path: entry for entry in entries}
+
+
+def save_catalog(root, entries):
+    path = os.path.join(root, CATALOG_FILE_NAME)
+    try:
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump([entry.to_dict(root) for entry in entries], f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+    except OSError:
+        # Read-only Takeout, the next open scans it again
+        pass
+
+
+@profiler.profiled('takeout_catalog.build')
+def build_catalog(root, workers=None, should_stop=None):
+    # Chats of the Takeout sorted by name, None if stopped
+    # Files are read in a thread pool: the time goes to reading, counting the keys is fast
+    if workers is None:
+        workers = Settings().get_catalog_workers()
+    previous = load_catalog(root)
+    date_parser = get_date_parser(Settings().get_locale())
+
+    entries = []
+    changed_paths = []
+    for path in find_chat_files(root):
+        entry = previous.get(path)
+        if entry is not None and entry.is_fresh(os.stat(path)):
+            entries.append(entry)
+        else:
+            changed_paths.append(path)
+
+    progress = ProgressTask('catalog', [('catalog', 100)])
+    progress.start_phase('catalog', len(changed_paths))
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = [executor.submit(scan_chat, path, date_parser) for path in changed_paths]
+        for done, future in enumerate(as_completed(futures), start=1):
+            if should_stop and should_stop():
+                for other_future in futures:
+                    other_future.cancel()
+                progress.finish()
+                return None
+            try:
+                entries.append(future.result())
+            except OSError:
+                # The file went away during the scan
+                pass
+            progress.update(done)
+
+    entries.sort(key=lambda entry: entry.name.lower())
+    if changed_paths or len(entries) != len(previous):
+        save_catalog(root, entries)
+    progress.finish()
+    return entries
+
+
+class ChatState:
+    # What the window needs to show a loaded chat again
+
+    def __init__(self, messages, main_dir, search_index=None, field_index=None, manifest=None):
+        self.messages = messages
+        self.main_dir = main_dir
+        self.search_index = search_index
+        self.field_index = field_index
+        self.manifest = manifest
+
+
+class ChatCache:
+    # Recently opened chats with their indexes, the least recently used one is dropped
+
+    def __init__(self, max_chats=None):
+        # None - the size from config.ini, read when the first chat comes
+        self._max_chats = max_chats
+        self._chats = OrderedDict()
+
+    @property
+    def max_chats(self):
+        if self._max_chats is None:
+            self._max_chats = Settings().get_chat_cache_size()
+        return self._max_chats
+
+    def get(self, path):
+        state = self._chats.get(path)
+        if state is not None:
+            self._chats.move_to_end(path)
+        return state
+
+    def put(self, path, state):
+        self._chats[path] = state
+        self._chats.move_to_end(path)
+        while len(self._chats) > max(self.max_chats, 0):
+            self._chats.popitem(last=False)
+
+    def clear(self):
+        self._chats.clear()
+
+    def __len__(self):
+        return len(self._chats)
+
+
+chat_cache = ChatCache()
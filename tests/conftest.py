@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Settings look for config.ini near the started script, the tests use the one of the viewer
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.argv[0] = os.path.join(ROOT, 'main_form.py')
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
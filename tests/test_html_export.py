@@ -0,0 +1,24 @@
+import json
+from html_export import export_html
+
+
+def test_message_texts_are_escaped(tmp_path):
+    archive_dir = tmp_path / 'Chat'
+    archive_dir.mkdir()
+    messages = [
+        {'creator': {'name': 'Alice <b>'}, 'text': 'hi <script>alert(1)</script>\nbye', 'message_id': 'space/1'},
+        {'creator': {'name': 'Bob'}, 'text': 'a & b', 'message_id': 'space/2',
+         'quoted_message_metadata': {'creator': {'name': 'Eve <i>'}, 'text': '<script>quoted</script>'}},
+    ]
+    (archive_dir / 'messages.json').write_text(json.dumps({'messages': messages}), encoding='utf-8')
+
+    output_dir = tmp_path / 'export'
+    pages = export_html(str(archive_dir / 'messages.json'), str(output_dir), page_by='count', workers=0)
+    page = (output_dir / pages[0][0]).read_text(encoding='utf-8')
+
+    assert '<script>' not in page
+    assert '&lt;script&gt;alert(1)&lt;/script&gt;<br>bye' in page
+    assert '&lt;script&gt;quoted&lt;/script&gt;' in page
+    assert 'Alice &lt;b&gt;' in page
+    assert 'Eve &lt;i&gt;' in page
+    assert 'a &amp; b' in page
@@ -0,0 +1,52 @@
+import struct
+import cv2
+import numpy as np
+import pytest
+from image_probe import probe_image_size, read_header_size
+
+
+def write_image(path, width, height, params=()):
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    ok, encoded = cv2.imencode(path.suffix, image, list(params))
+    assert ok
+    path.write_bytes(encoded.tobytes())
+    return path
+
+
+@pytest.mark.parametrize('name, params', [
+    ('picture.png', ()),
+    ('picture.jpg', ()),
+    ('progressive.jpg', (cv2.IMWRITE_JPEG_PROGRESSIVE, 1)),
+    ('lossy.webp', (cv2.IMWRITE_WEBP_QUALITY, 80)),
+    ('lossless.webp', (cv2.IMWRITE_WEBP_QUALITY, 101)),
+])
+def test_header_sizes(tmp_path, name, params):
+    path = write_image(tmp_path / name, 321, 123, params)
+    with open(path, 'rb') as f:
+        assert read_header_size(f) == (321, 123, True)
+
+
+def test_gif_header_size_is_not_shown_as_picture(tmp_path):
+    path = tmp_path / 'animation.gif'
+    path.write_bytes(b'GIF89a' + struct.pack('<HH', 640, 480) + b'\x00' * 20)
+    assert probe_image_size(str(path)) == (640, 480, False)
+
+
+def test_webp_extended_header(tmp_path):
+    path = tmp_path / 'extended.webp'
+    path.write_bytes(b'RIFF\x00\x00\x00\x00WEBPVP8X\x0a\x00\x00\x00\x10\x00\x00\x00'
+                     + (1999).to_bytes(3, 'little') + (999).to_bytes(3, 'little'))
+    assert probe_image_size(str(path)) == (2000, 1000, True)
+
+
+@pytest.mark.parametrize('name', ['picture.png', 'picture.jpg', 'lossy.webp'])
+def test_truncated_file_is_not_decodable(tmp_path, name):
+    path = write_image(tmp_path / name, 321, 123)
+    path.write_bytes(path.read_bytes()[:12])
+    assert probe_image_size(str(path)) == (0, 0, False)
+
+
+def test_empty_file_is_not_decodable(tmp_path):
+    path = tmp_path / 'empty.jpg'
+    path.write_bytes(b'')
+    assert probe_image_size(str(path)) == (0, 0, False)
@@ -0,0 +1,108 @@
+import datetime
+import random
+from message_store import MessageStore, MessageView
+
+
+def dated_message(number, timestamp, **fields):
+    message_data = {'creator': {'name': f'user{number % 3}'}, 'text': f'message {number}', 'message_id': f'space/{number}'}
+    if timestamp is not None:
+        main_date = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+        message_data.update(main_date=main_date, month_date=main_date.month, year_date=str(main_date.year))
+    message_data.update(fields)
+    return message_data
+
+
+def make_store(timestamps):
+    store = MessageStore()
+    store.append({})
+    for number, timestamp in enumerate(timestamps, start=1):
+        store.append(dated_message(number, timestamp))
+    return store
+
+
+def scan_month_start(store, year, month):
+    return next((i for i in range(1, len(store)) if store.year_month(i) == (year, month)), None)
+
+
+def month_timestamps(count, seed):
+    rng = random.Random(seed)
+    start = int(datetime.datetime(2020, 11, 20, tzinfo=datetime.timezone.utc).timestamp())
+    return [start + rng.randrange(120 * 86400) for _ in range(count)]
+
+
+def test_message_round_trip():
+    store = MessageStore()
+    store.append({})
+    message_data = dated_message(1, 1600000000, attached_files=[{'export_name': 'Photo.JPG'}, {'export_name': 'notes'}],
+                                 annotations=[{'url_metadata': {'title': 'x'}}], message_number=1)
+    store.append(message_data)
+    assert store[1] == message_data
+    assert store.text(1) == 'message 1'
+    assert store.creator_name(1) == 'user1'
+    assert store.timestamp(1) == 1600000000
+    assert store.year_month(1) == (2020, 9)
+    assert store.attachment_count(1) == 2
+    assert store.attachment_extensions(1) == ('jpg', '')
+    assert store.has_link(1)
+
+
+def test_message_without_date():
+    store = make_store([None])
+    assert store.timestamp(1) is None
+    assert store.year_month(1) == (None, None)
+    assert store[1]['main_date'] is None
+
+
+def test_set_timestamp_fills_the_month():
+    store = make_store([None, None])
+    store.set_timestamp(2, 1600000000)
+    assert store.year_month(2) == (2020, 9)
+    assert store.month_start(2020, 9) == 2
+
+
+def test_month_start_in_chronological_order():
+    store = make_store(sorted(month_timestamps(300, 1)))
+    expected = {key: scan_month_start(store, *key) for key in [(2020, 11), (2020, 12), (2021, 1), (2021, 2), (2021, 5)]}
+    store.build_timeline()
+    assert store.timeline.chronological
+    assert {key: store.month_start(*key) for key in expected} == expected
+
+
+def test_month_start_in_non_chronological_order():
+    store = make_store(month_timestamps(300, 2))
+    expected = {key: scan_month_start(store, *key) for key in [(2020, 11), (2020, 12), (2021, 1), (2021, 2), (2021, 5)]}
+    store.build_timeline()
+    assert not store.timeline.chronological
+    assert {key: store.month_start(*key) for key in expected} == expected
+    # Years and their months in the order their first messages come
+    expected_months = {}
+    for i in range(1, len(store)):
+        year, month = store.year_month(i)
+        months = expected_months.setdefault(str(year), [])
+        if month not in months:
+            months.append(month)
+    assert store.year_months() == expected_months
+    assert list(store.year_months()) == list(expected_months)
+
+
+def test_positions_between_equal_a_scan():
+    store = make_store(month_timestamps(300, 3) + [None])
+    timeline = store.build_timeline()
+    start = int(datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+    end = int(datetime.datetime(2021, 2, 1, tzinfo=datetime.timezone.utc).timestamp())
+    expected = [i for i in range(1, len(store)) if store.timestamp(i) is not None and start <= store.timestamp(i) < end]
+    assert list(timeline.positions_between(start, end)) == expected
+    assert timeline.count_between(start, end) == len(expected)
+
+
+def test_view_reads_the_original_messages():
+    store = make_store(sorted(month_timestamps(20, 4)))
+    view = MessageView(store)
+    for original_number in (3, 7, 11):
+        view.append(original_number)
+    assert len(view) == 4
+    assert view.text(2) == store.text(7)
+    assert view[2]['message_number'] == 2
+    assert view[2]['original_number'] == 7
+    view.build_timeline()
+    assert view.month_start(*store.year_month(3)) == 1
@@ -0,0 +1,54 @@
+import json
+import pytest
+from messages_loader import iter_json_messages, correct_message_export_names
+
+MESSAGES = [
+    {'creator': {'name': 'Алиса'}, 'text': 'привет, мир 😀', 'message_id': 'space/1'},
+    {'creator': {'name': 'Bob'}, 'text': 'quotes \" and \\ backslash, ] bracket, { brace', 'message_id': 'space/2'},
+    {'creator': {'name': 'Eve'}, 'text': 'line\nbreak\ttab é \U0001F600', 'message_id': 'space/3'},
+    {'creator': {'name': 'Bob'}, 'text': '', 'message_id': 'space/4', 'attached_files': [{'export_name': 'a.jpg'}]},
+]
+
+
+def write_messages(path, ensure_ascii, indent=None):
+    # ensure_ascii=True writes \u escapes and surrogate pairs, False - raw multibyte UTF-8
+    path.write_text(json.dumps({'messages': MESSAGES}, ensure_ascii=ensure_ascii, indent=indent), encoding='utf-8')
+    return path
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 7, 64, 1 << 16])
+@pytest.mark.parametrize('ensure_ascii', [False, True])
+def test_chunk_boundaries_inside_characters_and_escapes(tmp_path, chunk_size, ensure_ascii):
+    path = write_messages(tmp_path / 'messages.json', ensure_ascii, indent=1)
+    loaded = [message_data for message_data, _, _ in iter_json_messages(str(path), chunk_size)]
+    assert loaded == MESSAGES
+
+
+def test_progress_reaches_the_file_size(tmp_path):
+    path = write_messages(tmp_path / 'messages.json', False)
+    progress = [(bytes_read, file_size) for _, bytes_read, file_size in iter_json_messages(str(path), 16)]
+    assert progress[-1][1] == path.stat().st_size
+    assert all(earlier[0] <= later[0] for earlier, later in zip(progress, progress[1:]))
+
+
+def test_messages_after_other_keys(tmp_path):
+    path = tmp_path / 'messages.json'
+    path.write_text('{"name": "x", "other": [1, 2], "messages" : [ ]}', encoding='utf-8')
+    assert list(iter_json_messages(str(path), 4)) == []
+
+
+def test_broken_file_raises(tmp_path):
+    path = tmp_path / 'messages.json'
+    path.write_text('{"messages": [{"text": "a"}, {"text": ', encoding='utf-8')
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_messages(str(path), 8))
+
+
+def test_repeated_export_names_get_numbers():
+    seen_names = {}
+    names = []
+    for _ in range(3):
+        message_data = {'attached_files': [{'export_name': 'photo.jpg'}]}
+        correct_message_export_names(message_data, seen_names)
+        names.append(message_data['attached_files'][0]['export_name'])
+    assert names == ['photo.jpg', 'photo(1).jpg', 'photo(2).jpg']
@@ -0,0 +1,59 @@
+import datetime
+import random
+from message_store import MessageStore
+from query import FieldIndex, parse_query, plan_query
+from search_index import TrigramIndex
+
+
+def test_fields_leave_single_spaces():
+    search_query = parse_query('hello from:bob world')
+    assert search_query.text == 'hello world'
+    assert search_query.senders
+
+
+def test_text_without_fields_stays_as_typed():
+    assert parse_query('  hello  world ').text == '  hello  world '
+
+
+def test_text_around_fields_keeps_its_spaces():
+    assert parse_query('say  "hi"   there from:bob  now').text == 'say  "hi"   there now'
+
+
+def planner_store():
+    rng = random.Random(5)
+    words = ('hello', 'world', 'отчёт', 'lunch', 'a', 'zz', 'report.pdf')
+    store = MessageStore()
+    store.append({})
+    start = int(datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+    for number in range(1, 600):
+        message_data = {'creator': {'name': rng.choice(('Alice Smith', 'Bob Jones', 'Carol'))},
+                        'text': ' '.join(rng.choice(words) for _ in range(rng.randint(0, 6))), 'message_id': str(number)}
+        if rng.random() < 0.9:
+            main_date = datetime.datetime.fromtimestamp(start + rng.randrange(90 * 86400), datetime.timezone.utc)
+            message_data.update(main_date=main_date, month_date=main_date.month, year_date=str(main_date.year))
+        if rng.random() < 0.2:
+            message_data['attached_files'] = [{'export_name': rng.choice(('photo.jpg', 'scan.PNG', 'report.pdf', 'notes'))}]
+        if rng.random() < 0.1:
+            message_data['annotations'] = [{'url_metadata': {'title': 'page'}}]
+        store.append(message_data)
+    store.build_timeline()
+    return store
+
+
+def test_plan_equals_a_linear_scan():
+    store = planner_store()
+    field_index = FieldIndex()
+    field_index.build(store)
+    search_index = TrigramIndex()
+    search_index.build(store)
+    sources = ['hello', 'a', 'zz', 'ё', 'o w', 'from:alice', 'from:"bob jones" hello', 'date:2021-02', 'after:2021-01-15 before:2021-03-01',
+               'has:image', 'has:attachment from:carol', 'has:link', 'ext:pdf', 'ext:.png lunch', 'date:2021-02-30',
+               'отчёт has:link', 'nothing-like-this']
+    for source in sources:
+        try:
+            search_query = parse_query(source)
+        except ValueError:
+            continue
+        expected = [i for i in range(1, len(store)) if search_query.matches(store, i)]
+        for index in (search_index, None):
+            assert list(plan_query(search_query, store, field_index, index, store.timeline)) == expected, source
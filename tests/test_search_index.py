@@ -0,0 +1,41 @@
+from search_index import TrigramIndex
+
+
+class Texts:
+    def __init__(self, texts):
+        self.texts = texts
+
+    def __len__(self):
+        return len(self.texts)
+
+    def text(self, i):
+        return self.texts[i]
+
+
+def build_index(texts):
+    messages_data = Texts(texts)
+    index = TrigramIndex()
+    index.build(messages_data)
+    return index, messages_data
+
+
+def test_short_query_in_the_middle_of_a_trigram():
+    index, messages_data = build_index([None, 'xay', 'hello'])
+    assert index.search(messages_data, 'a') == [1]
+    assert index.search(messages_data, 'l') == [2]
+    assert index.search(messages_data, 'e') == [2]
+
+
+def test_two_letter_queries():
+    index, messages_data = build_index([None, 'xay', 'hello', 'ok'])
+    assert index.search(messages_data, 'el') == [2]
+    assert index.search(messages_data, 'll') == [2]
+    assert index.search(messages_data, 'ay') == [1]
+    assert index.search(messages_data, 'ok') == [3]
+    assert index.search(messages_data, 'zz') == []
+
+
+def test_long_query():
+    index, messages_data = build_index(['Hello world', 'hello', 'world'])
+    assert index.search(messages_data, 'hello') == [0, 1]
+    assert index.search(messages_data, 'o wor') == [0]
@@ -0,0 +1,171 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QObject, pyqtSignal, QUrl
+from PyQt5.QtGui import QImage, QColor
+from attachment_manifest import viewer_cache_path, directory_key
+
+# Thumbnails live in the viewer folder near messages.json, one folder per width bucket
+THUMBNAILS_DIR_NAME = 'thumbnails'
+WIDTH_BUCKET = 128
+
+
+class ThumbnailEmitter(QObject):
+    # Thumbnail path from the page and the file to show there:
+    # the thumbnail itself or the original picture if it could not be made
+    thumbnail_ready = pyqtSignal(str, str)
+
+    def emit_ready(self, thumbnail_path, image_path):
+        self.thumbnail_ready.emit(thumbnail_path, image_path)
+
+thumbnail_emitter = ThumbnailEmitter()
+
+
+_placeholder_image = None
+
+
+def placeholder_image():
+    # Shown instead of a thumbnail that is not ready yet
+    global _placeholder_image
+    if _placeholder_image is None:
+        _placeholder_image = QImage(16, 16, QImage.Format_RGB32)
+        _placeholder_image.fill(QColor(225, 225, 225))
+    return _placeholder_image
+
+
+def width_bucket(width):
+    # Display width rounded up, so a small resize uses the same thumbnails
+    return max(WIDTH_BUCKET, -(-int(width) // WIDTH_BUCKET) * WIDTH_BUCKET)
+
+
+def picture_width(browser_width):
+    # Pictures of the page are not wider than a third of the browser
+    return browser_width // 3
+
+
+def thumbnail_file_name(img_path, directory):
+    # The same picture gets the same name in the viewer cache and in the HTML export
+    key = os.path.relpath(img_path, directory)
+    name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    ext = '.png' if img_path.lower().endswith('.png') else '.jpg'
+    return name + ext
+
+
+def make_thumbnail(img_path, thumbnail_path, width):
+    # Downscaled copy of the picture, False if the picture cannot be decoded
+    import cv2
+    import numpy as np
+
+    # CV2 cannot read or write non-latin filenames, so we are working with bytes
+    with open(img_path, "rb") as f:
+        chunk_arr = np.frombuffer(f.read(), dtype=np.uint8)
+    image = cv2.imdecode(chunk_arr, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        return False
+
+    height_original, width_original = image.shape[:2]
+    height = max(1, int(width * height_original / width_original))
+    thumbnail = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+    ext = os.path.splitext(thumbnail_path)[1]
+    ok, encoded = cv2.imencode(ext, thumbnail)
+    if not ok:
+        return False
+
+    temporary_path = thumbnail_path + '.tmp'
+    with open(temporary_path, 'wb') as f:
+        f.write(encoded.tobytes())
+    os.replace(temporary_path, thumbnail_path)
+    return True
+
+
+class ThumbnailCache:
+    # Thumbnails are made in a thread pool, the page shows a placeholder until thumbnail_ready
+
+    def __init__(self, directory, workers=2):
+        self.directory = directory
+        self.cache_dir = viewer_cache_path(directory, THUMBNAILS_DIR_NAME)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._pending = set()
+        # Pictures that cannot be thumbnailed are shown as they are
+        self._failed = set()
+        # Thumbnail path -> picture, for the pages that got the thumbnail URL before it failed
+        self._failed_thumbnails = {}
+        # bucket -> names of the made thumbnails, so the page does not stat every picture
+        self._made = {}
+
+    def thumbnail_path(self, img_path, bucket):
+        return os.path.join(self.cache_dir, str(bucket), thumbnail_file_name(img_path, self.directory))
+
+    def image_url(self, img_path, display_width, original_width):
+        # URL for the <img> tag: the thumbnail (maybe not ready yet) or the original if it is small
+        bucket = width_bucket(display_width)
+        if original_width <= bucket or img_path in self._failed:
+            return QUrl.fromLocalFile(img_path).toString()
+
+        thumbnail_path = self.thumbnail_path(img_path, bucket)
+        if os.path.basename(thumbnail_path) not in self._made_names(bucket):
+            self.request(img_path, thumbnail_path, bucket)
+        return QUrl.fromLocalFile(thumbnail_path).toString()
+
+    def _made_names(self, bucket):
+        # One scandir of the bucket folder, later thumbnails are added by _make
+        names = self._made.get(bucket)
+        if names is None:
+            try:
+                with os.scandir(os.path.join(self.cache_dir, str(bucket))) as entries:
+                    names = {entry.name for entry in entries}
+            except OSError:
+                names = set()
+            # The window and a worker can read it at the same time, both get the same set
+            names = self._made.setdefault(bucket, names)
+        return names
+
+    def request(self, img_path, thumbnail_path, bucket):
+        with self._lock:
+            if thumbnail_path in self._pending:
+                return
+            self._pending.add(thumbnail_path)
+        self._executor.submit(self._make, img_path, thumbnail_path, bucket)
+
+    def is_pending(self, thumbnail_path):
+        return thumbnail_path in self._pending
+
+    def failed_original(self, thumbnail_path):
+        # The picture to show instead of a thumbnail that could not be made, None otherwise
+        return self._failed_thumbnails.get(thumbnail_path)
+
+    def _make(self, img_path, thumbnail_path, bucket):
+        try:
+            os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+            ok = make_thumbnail(img_path, thumbnail_path, bucket)
+        except OSError:
+            # Read-only archive folder
+            ok = False
+        if ok:
+            self._made_names(bucket).add(os.path.basename(thumbnail_path))
+        else:
+            self._failed_thumbnails[thumbnail_path] = img_path
+            self._failed.add(img_path)
+
+        with self._lock:
+            self._pending.discard(thumbnail_path)
+        thumbnail_emitter.emit_ready(thumbnail_path, thumbnail_path if ok else img_path)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_current_cache = None
+
+
+def get_thumbnail_cache(directory):
+    # Thumbnails of the opened archive
+    global _current_cache
+    if _current_cache is None or directory_key(_current_cache.directory) != directory_key(directory):
+        if _current_cache is not None:
+            _current_cache.shutdown()
+        _current_cache = ThumbnailCache(directory)
+    return _current_cache
@@ -0,0 +1,89 @@
+import datetime
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+
+
+def month_start_timestamp(year, month):
+    return int(datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc).timestamp())
+
+
+def next_month_timestamp(year, month):
+    return month_start_timestamp(year + 1, 1) if month == 12 else month_start_timestamp(year, month + 1)
+
+
+class Timeline:
+    # One pass over the message dates:
+    # (year, month) -> first message, and timestamps sorted for bisect with their positions
+
+    def __init__(self):
+        self.month_starts = {}
+        # Months in the order of messages
+        self.months = []
+        self.timestamps = array('q')
+        self.positions = array('I')
+        # Messages go in time order, so the first message of a month is the earliest one
+        self.chronological = True
+
+    @classmethod
+    def from_columns(cls, timestamps, years, months, count, no_date):
+        timeline = cls()
+        month_starts = timeline.month_starts
+        sorted_timestamps = timeline.timestamps
+        positions = timeline.positions
+        last_timestamp = None
+
+        for i in range(count):
+            timestamp = timestamps[i]
+            if timestamp == no_date:
+                continue
+            key = (years[i], months[i])
+            if key not in month_starts:
+                month_starts[key] = i
+                timeline.months.append(key)
+            if last_timestamp is not None and timestamp < last_timestamp:
+                timeline.chronological = False
+            last_timestamp = timestamp
+            sorted_timestamps.append(timestamp)
+            positions.append(i)
+
+        if not timeline.chronological:
+            pairs = sorted(zip(sorted_timestamps, positions))
+            timeline.timestamps = array('q', (timestamp for timestamp, _ in pairs))
+            timeline.positions = array('I', (position for _, position in pairs))
+        return timeline
+
+    def year_months(self):
+        # {year string: [month numbers]} in the order of messages, O(months)
+        structure = defaultdict(list)
+        for year, month in self.months:
+            structure[str(year)].append(month)
+        return structure
+
+    def first_at_or_after(self, timestamp):
+        # Position of the earliest message not older than timestamp, None if there is none
+        i = bisect_left(self.timestamps, timestamp)
+        return self.positions[i] if i < len(self.timestamps) else None
+
+    def month_start(self, year, month):
+        # The first message of the month or None
+        year = int(year)
+        if self.chronological:
+            start = month_start_timestamp(year, month)
+            i = bisect_left(self.timestamps, start)
+            if i < len(self.timestamps) and self.timestamps[i] < next_month_timestamp(year, month):
+                return self.positions[i]
+            return None
+        return self.month_starts.get((year, month))
+
+    def positions_between(self, start_timestamp=None, end_timestamp=None):
+        # Sorted positions of messages with start <= timestamp < end
+        low = 0 if start_timestamp is None else bisect_left(self.timestamps, start_timestamp)
+        high = len(self.timestamps) if end_timestamp is None else bisect_left(self.timestamps, end_timestamp)
+        positions = self.positions[low:high]
+        return positions if self.chronological else array('I', sorted(positions))
+
+    def count_between(self, start_timestamp=None, end_timestamp=None):
+        low = 0 if start_timestamp is None else bisect_left(self.timestamps, start_timestamp)
+        high = len(self.timestamps) if end_timestamp is None else bisect_left(self.timestamps, end_timestamp)
+        return max(0, high - low)
@@ -1,12 +1,26 @@
-from PyQt5.QtWidgets import QMainWindow, QFileDialog, QTextBrowser, QMessageBox
-from PyQt5.QtCore import QObject, pyqtSignal, QUrl
-from PyQt5.QtGui import QDesktopServices, QTextCursor, QTextDocument, QFont
+import os
+from PyQt5.QtWidgets import QMainWindow, QFileDialog, QTextBrowser, QMessageBox, QShortcut, QSplitter, QTreeWidget, QTreeWidgetItem
+from PyQt5.QtCore import QObject, pyqtSignal, QUrl, Qt
+from PyQt5.QtGui import QDesktopServices, QTextCursor, QTextDocument, QFont, QKeySequence
 from PyQt5.uic import loadUi
-from messages_loader import load_json, create_html_page, progress_emitter, prepare_date_structure
+from messages_loader import load_json, load_store, create_html_page, prepare_date_structure, get_month_numbers
+from progress import ProgressTask, progress_emitter, PHASE_TITLES
+from profiling import profiler
 from messages_model import Settings, chat_data, resource_path
-import re
-from calendar import month_name, different_locale
-from PyQt5.QtCore import QObject, pyqtSignal, QThread
+from thumbnails import thumbnail_emitter, picture_width
+from image_cache import image_cache, document_image
+from fragment_cache import fragment_cache, fragment_width
+from chat_list_view import ChatListView
+from document_index import AnchorIndex
+from search_index import TrigramIndex
+from query import FieldIndex, parse_query, plan_query
+from archive_store import StoredMessageList
+from message_store import MessageView
+from takeout_catalog import build_catalog, chat_cache, date_span_text, ChatState
+from html_export import export_html, INDEX_FILE_NAME
+from attachment_manifest import get_attachment_manifest, use_attachment_manifest
+from image_probe import save_image_size_cache
+from PyQt5.QtCore import QObject, pyqtSignal, QThread, QTimer, QFileSystemWatcher
 
 class ResizableTextBrowser(QTextBrowser):
     resized = pyqtSignal()
@@ -15,6 +29,21 @@ class ResizableTextBrowser(QTextBrowser):
         super().resizeEvent(event)
         self.resized.emit()
 
+    def loadResource(self, resource_type, url):
+        # Every new page asks for its pictures again, they come decoded from the shared cache
+        # at the width of the pictures in the page
+        if resource_type == QTextDocument.ImageResource:
+            image = document_image(url, picture_width(fragment_width(chat_data.text_browser_width)))
+            if image is not None:
+                return image
+        return super().loadResource(resource_type, url)
+
+    def replace_image(self, url, image):
+        # Swapping the picture in the current page without rebuilding it
+        document = self.document()
+        document.addResource(QTextDocument.ImageResource, url, image)
+        document.markContentsDirty(0, document.characterCount())
+
 class ScrollListener(QObject):
     scrollChanged = pyqtSignal()
 
@@ -27,15 +56,123 @@ class ScrollListener(QObject):
         self.scrollChanged.emit()   
 
 class LoadJsonThread(QThread):
+    # Number of loaded messages, sent after every batch
+    batch_loaded = pyqtSignal(int)
+
     def __init__(self, fname):
         super().__init__()
         self.fname = fname
 
+    def on_batch(self, messages):
+        # The list keeps growing in this thread, the window only reads it
+        if self.isInterruptionRequested():
+            return
+        chat_data.messages_list = messages
+        self.batch_loaded.emit(len(messages))
+
     def run(self):
-        messages, dir = load_json(self.fname)
+        if Settings().get_storage() == 'sqlite':
+            messages, dir = load_store(self.fname, should_stop=self.isInterruptionRequested)
+        else:
+            messages, dir = load_json(self.fname, batch_callback=self.on_batch, should_stop=self.isInterruptionRequested)
+        # Another chat was selected meanwhile
+        if self.isInterruptionRequested():
+            return
         chat_data.messages_list = messages
         chat_data.main_dir = dir
 
+class CatalogThread(QThread):
+    # Lists the chats of a Takeout folder
+    def __init__(self, root):
+        super().__init__()
+        self.root = root
+        self.entries = None
+
+    def run(self):
+        self.entries = build_catalog(self.root, should_stop=self.isInterruptionRequested)
+
+class ExportThread(QThread):
+    # HTML pages of a chat, read again from its file
+    def __init__(self, fname, output_dir):
+        super().__init__()
+        self.fname = fname
+        self.output_dir = output_dir
+        self.pages = None
+
+    def run(self):
+        self.pages = export_html(self.fname, self.output_dir, should_stop=self.isInterruptionRequested)
+
+class SearchIndexThread(QThread):
+    # Builds the search index after loading, searching works without it meanwhile
+    def __init__(self, messages):
+        super().__init__()
+        self.messages = messages
+
+    def run(self):
+        search_index = TrigramIndex()
+        field_index = FieldIndex()
+        progress = ProgressTask('index', [('index', 60), ('fields', 40)])
+        progress.start_phase('index', len(self.messages))
+        if search_index.build(self.messages, should_stop=self.isInterruptionRequested, progress_callback=progress.update):
+            progress.start_phase('fields', len(self.messages))
+            if field_index.build(self.messages, should_stop=self.isInterruptionRequested, progress_callback=progress.update):
+                if chat_data.original_messages_list is self.messages:
+                    chat_data.search_index = search_index
+                    chat_data.field_index = field_index
+        progress.finish()
+
+class SearchThread(QThread):
+    # Searches in a worker, found messages keep coming into results while the first page is shown
+    # Number of results (with the zero message), sent after every batch
+    results_found = pyqtSignal(int)
+
+    def __init__(self, messages, search_query, search_index=None, field_index=None, batch_size=50):
+        super().__init__()
+        self.messages = messages
+        self.search_query = search_query
+        self.search_index = search_index
+        self.field_index = field_index
+        self.batch_size = batch_size
+        # Searching inside results gives a view over the same original list
+        self.results = MessageView(messages.base if isinstance(messages, MessageView) else messages)
+        self.cancelled = False
+
+    def found_numbers(self):
+        # Message numbers in ascending order
+        messages = self.messages
+        if isinstance(messages, StoredMessageList):
+            return messages.store.query(self.search_query)
+        # The indexes cover the whole archive, searching inside results goes through the list
+        if self.search_index is not None and self.field_index is not None:
+            return plan_query(self.search_query, messages, self.field_index, self.search_index, messages.timeline)
+        return self.scan_messages()
+
+    def scan_messages(self):
+        # Search without the indexes
+        messages = self.messages
+        for i in range(1, len(messages)):
+            if self.search_query.matches(messages, i):
+                yield i
+            elif i % 10000 == 0 and self.isInterruptionRequested():
+                return
+
+    @profiler.profiled('search')
+    def run(self):
+        # Progress is how far the search went through the archive
+        progress = ProgressTask('search', [('search', 100)])
+        progress.start_phase('search', len(self.messages))
+        results = self.results
+        for number in self.found_numbers():
+            if self.isInterruptionRequested():
+                self.cancelled = True
+                break
+            results.append(self.messages.original_number(number) if isinstance(self.messages, MessageView) else number)
+            if len(results) % self.batch_size == 1:
+                self.results_found.emit(len(results))
+            progress.update(number)
+        results.build_timeline()
+        progress.finish()
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super(MainWindow, self).__init__()
@@ -64,8 +201,33 @@ class MainWindow(QMainWindow):
         self.font.setPointSize(14)
         self.textBrowser.setFont(self.font) 
 
+        # Virtualized list instead of the text browser
+        self.chat_view = None
+        if Settings().get_chat_view() == 'list':
+            self.chat_view = ChatListView()
+            self.chat_view.setFont(self.font)
+            self.verticalLayout.replaceWidget(self.textBrowser, self.chat_view)
+            self.textBrowser.hide()
+            self.chat_view.link_clicked.connect(self.open_link)
+
+        # Chats of an opened Takeout on the left, hidden until a Takeout is opened
+        self.chat_tree = QTreeWidget()
+        self.chat_tree.setHeaderLabels(["Chat", "Messages", "Dates", "Size, MB"])
+        self.chat_tree.setRootIsDecorated(False)
+        self.chat_tree.setSortingEnabled(True)
+        self.chat_tree.currentItemChanged.connect(self.on_chat_selected)
+        self.chat_tree.hide()
+        chat_widget = self.chat_view or self.textBrowser
+        self.chat_splitter = QSplitter(Qt.Horizontal)
+        self.verticalLayout.replaceWidget(chat_widget, self.chat_splitter)
+        self.chat_splitter.addWidget(self.chat_tree)
+        self.chat_splitter.addWidget(chat_widget)
+        self.chat_splitter.setStretchFactor(1, 1)
+
         # Main load button
         self.loadButton.clicked.connect(self.load_json)
+        self.takeoutButton.clicked.connect(self.open_takeout)
+        self.exportButton.clicked.connect(self.export_chat)
         
         # Listening for events
         self.textBrowser.installEventFilter(self)
@@ -82,6 +244,8 @@ class MainWindow(QMainWindow):
         self.textBrowser.resized.connect(self.on_textBrowser_resize)
 
         progress_emitter.progress_changed.connect(self.update_progress_bar)
+        progress_emitter.progress_finished.connect(self.on_progress_finished)
+        thumbnail_emitter.thumbnail_ready.connect(self.on_thumbnail_ready)
 
         self.updating_scrollbar = False
 
@@ -91,23 +255,66 @@ class MainWindow(QMainWindow):
         self.search_cursor = None
 
         self.pushButton_B.clicked.connect(self.search_in_database)
+        self.pushButton_Cancel.clicked.connect(self.cancel_search)
         self.pushButton_Clean.clicked.connect(self.search_clean)
+
+        # Changing the text repeats the search after a pause in typing
+        self.search_thread = None
+        # Stopped workers are kept until they finish
+        self.stopped_searches = []
+        self.results_shown = False
+        self.search_base = None
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(400)
+        self.search_timer.timeout.connect(self.repeat_search)
+        self.lineEdit_B.textChanged.connect(self.on_search_text_changed)
         self.monthButton.clicked.connect(self.monthLoader)
 
         # Year-Month combo
         self.comboBox_y.currentIndexChanged.connect(lambda: self.update_month_combo_box(chat_data.date_structure, self.comboBox_y, self.comboBox_m))
 
         self.load_thread = None
+        self.index_thread = None
+        self.catalog_thread = None
+        self.export_thread = None
+        # Stopped loaders are kept until they finish
+        self.stopped_loads = []
+        # messages.json of the open chat, the key of the chat cache
+        self.chat_path = None
+        # message_number -> position in the current page
+        self.anchor_index = AnchorIndex()
+        # The first page is shown while the file is still loading
+        self.first_page_shown = False
+
+        # Files added to or removed from the archive folder update the attachment manifest
+        self.attachment_watcher = QFileSystemWatcher(self)
+        self.attachment_watcher.directoryChanged.connect(lambda: self.attachments_timer.start())
+        # Several changes in a row, e.g. copying many files, make one update
+        self.attachments_timer = QTimer(self)
+        self.attachments_timer.setSingleShot(True)
+        self.attachments_timer.setInterval(500)
+        self.attachments_timer.timeout.connect(self.on_attachments_changed)
+
+        # Timing of the stages, recorded when profiling is on
+        QShortcut(QKeySequence("Ctrl+Shift+P"), self, self.show_profiling)
 
     def on_font_changed(self):
             selected_size = int(self.comboBox_F.currentText())
             self.font.setPointSize(selected_size)
             self.textBrowser.setFont(self.font)
+            chat_data.font_size = selected_size
+            if self.chat_view:
+                self.chat_view.setFont(self.font)
 
     def on_messages_list_changed(self):
+            # Message numbers are different now
+            fragment_cache.clear()
             # Rebuilding year-month list
             prepare_date_structure(chat_data.messages_list)
             self.populate_comboboxes(chat_data.date_structure, self.comboBox_y, self.comboBox_m)
+            if self.chat_view:
+                self.chat_view.reset_messages()
 
     
     def populate_comboboxes(self, year_month_structure, combo_box_year, combo_box_month):
@@ -136,29 +343,26 @@ class MainWindow(QMainWindow):
         # Jumping to a specific month
         locale_str = Settings().get_locale()
 
-        # Temporary dict with months names in the local language
-        temporary_dict = {}
-        with different_locale(locale_str):
-            for i in range(1, 13):
-                temporary_dict[month_name[i]] = i
-    
         selected_month_name = self.comboBox_m.currentText() 
 
-        month_index_in_year = temporary_dict.get(selected_month_name)
+        # Months names in the local language, made once per locale
+        month_index_in_year = get_month_numbers(locale_str).get(selected_month_name)
 
         selected_year = self.comboBox_y.currentText()
 
         # Looking for 1st message of the month
         start_index = None
-        for i, message in enumerate(chat_data.messages_list):
-            if message.get("year_date") == selected_year:
-                if message.get("month_date") == month_index_in_year:
-                    start_index = i
-                    break
-        else:
+        if selected_year and month_index_in_year:
+            start_index = chat_data.messages_list.month_start(selected_year, month_index_in_year)
+
+        if start_index is None:
             QMessageBox.information(self, "No Results", "No results")
             return
 
+        if self.chat_view:
+            self.chat_view.scroll_to_message(start_index)
+            return
+
         # Moving the position to this message
         end_index = min(start_index + 50, len(chat_data.messages_list))
 
@@ -167,14 +371,16 @@ class MainWindow(QMainWindow):
         self.updating_scrollbar = False
 
         html_source = create_html_page(chat_data.text_browser_width, chat_data.main_dir, chat_data.messages_list, start_index, end_index)
-        self.textBrowser.setHtml(html_source)
+        self.set_page(html_source)
         chat_data.start_message = start_index
         chat_data.end_message = end_index
 
     # Just searching in the browser
     def search_in_browser(self):
         self.search_text = self.lineEdit_S.text()
-        if self.search_text:
+        if self.search_text and self.chat_view:
+            self.chat_view.find_text(self.search_text, self.checkBox.isChecked())
+        elif self.search_text:
             if self.search_cursor is None:
                 self.search_cursor = self.textBrowser.textCursor()
             flags = QTextDocument.FindFlags()
@@ -193,45 +399,101 @@ class MainWindow(QMainWindow):
 
     # Searching in the whole base
     def search_in_database(self):
-        search_text = self.lineEdit_B.text()
-        if search_text and len(search_text)>4: 
-            
-            # Reapeating the process of messaging in load_json with selected ones
-            searched_list = []
-            searched_list.insert(0, {})
-            x = 0
-
-
-            for i,message in enumerate(chat_data.messages_list):
-                if 'text' in message:
-                    if search_text.lower() in message["text"].lower():
-                        searched_message = message.copy() 
-                        x = x + 1 
-                        searched_message['message_number'] = x
-                        searched_list.append(searched_message)
-                else:
-                    pass
-                progress = int((i + 1) / chat_data.total_messages * 100)
-                progress_emitter.emit_progress(progress)
-
-            if len(searched_list)>1:
-                chat_data.messages_list = searched_list
-                self.on_messages_list_changed()
-                html_source = create_html_page(chat_data.text_browser_width, chat_data.main_dir, chat_data.messages_list, 0, 50)
-                self.updating_scrollbar = True
-                self.textBrowser.clear()  # Очищаем содержимое textBrowser
-                self.updating_scrollbar = False                
-                self.textBrowser.setHtml(html_source)
-                chat_data.searchingFlag = True
-                chat_data.start_message = 0 
-                chat_data.end_message = 50
-                #print(len(chat_data.messages_list))
-                self.pushButton_Clean.setEnabled(True)
+        # Searching inside results goes through the shown list
+        self.search_base = chat_data.messages_list
+        self.start_search(self.lineEdit_B.text())
+
+    def start_search(self, search_text, show_errors=True):
+        self.search_timer.stop()
+        self.stop_search()
+        if not search_text or not self.search_base:
+            return
+        try:
+            search_query = parse_query(search_text)
+        except ValueError as error:
+            if show_errors:
+                QMessageBox.warning(self, "Wrong query", str(error))
+            return
+
+        indexed = self.search_base is chat_data.original_messages_list
+        self.search_thread = SearchThread(self.search_base, search_query,
+                                          chat_data.search_index if indexed else None, chat_data.field_index if indexed else None)
+        self.search_thread.results_found.connect(self.on_results_found)
+        self.search_thread.finished.connect(self.on_search_finished)
+        self.results_shown = False
+        self.pushButton_Cancel.setEnabled(True)
+        self.search_thread.start()
+
+    def stop_search(self):
+        # The old worker is left to stop on its own, its signals are not needed anymore
+        search_thread = self.search_thread
+        if search_thread is not None:
+            search_thread.results_found.disconnect(self.on_results_found)
+            search_thread.finished.disconnect(self.on_search_finished)
+            search_thread.requestInterruption()
+            self.stopped_searches.append(search_thread)
+            search_thread.finished.connect(lambda: self.stopped_searches.remove(search_thread))
+            self.search_thread = None
+        self.pushButton_Cancel.setEnabled(False)
+
+    def cancel_search(self):
+        # Found messages stay on the screen
+        if self.search_thread is not None:
+            self.search_thread.requestInterruption()
+
+    def on_search_text_changed(self, text):
+        # Only a running or shown search is repeated
+        if self.search_thread is not None or chat_data.searchingFlag:
+            self.search_timer.start()
+
+    def repeat_search(self):
+        # The query can be unfinished while typing
+        self.start_search(self.lineEdit_B.text(), show_errors=False)
+
+    def on_results_found(self, count):
+        if not self.results_shown:
+            # The first page is ready
+            self.show_results(self.search_thread.results)
+        elif self.chat_view:
+            self.chat_view.messages_appended()
+
+    def show_results(self, searched_list):
+        self.results_shown = True
+        chat_data.messages_list = searched_list
+        self.on_messages_list_changed()
+        html_source = create_html_page(chat_data.text_browser_width, chat_data.main_dir, chat_data.messages_list, 0, 50)
+        self.updating_scrollbar = True
+        self.textBrowser.clear()  # Очищаем содержимое textBrowser
+        self.updating_scrollbar = False                
+        self.set_page(html_source)
+        chat_data.searchingFlag = True
+        chat_data.start_message = 0 
+        chat_data.end_message = 50
+        self.pushButton_Clean.setEnabled(True)
+
+    def on_search_finished(self):
+        search_thread = self.search_thread
+        self.search_thread = None
+        self.pushButton_Cancel.setEnabled(False)
+        searched_list = search_thread.results
+
+        if len(searched_list) > 1:
+            if not self.results_shown:
+                self.show_results(searched_list)
             else:
-                QMessageBox.information(self, "No Results", f"No results found for '{search_text}'")
+                # All months of the results are known now
+                prepare_date_structure(searched_list)
+                self.populate_comboboxes(chat_data.date_structure, self.comboBox_y, self.comboBox_m)
+                if self.chat_view:
+                    self.chat_view.messages_appended()
+            if search_thread.cancelled:
+                self.statusBar().showMessage(f"Search cancelled, {len(searched_list) - 1} messages found")
+        elif not search_thread.cancelled:
+            QMessageBox.information(self, "No Results", f"No results found for '{search_thread.search_query.source}'")
 
     def search_clean(self):
         # Returning to dataset of all messages, not just founded
+        self.stop_search()
         self.updating_scrollbar = True
         self.textBrowser.clear() 
         self.updating_scrollbar = False
@@ -239,7 +501,7 @@ class MainWindow(QMainWindow):
         chat_data.messages_list = chat_data.original_messages_list
         self.on_messages_list_changed()
         html_source = create_html_page(chat_data.text_browser_width, chat_data.main_dir, chat_data.messages_list, 0, 50)
-        self.textBrowser.setHtml(html_source)
+        self.set_page(html_source)
         chat_data.searchingFlag = False
         chat_data.start_message = 0 
         chat_data.end_message = 50        
@@ -258,109 +520,374 @@ class MainWindow(QMainWindow):
         # There is count of lines in the visible area
         return lines
 
+    @profiler.profiled('get_anchor_position')
     def get_anchor_position(self, text_browser, anchor_id):
-        # We are looking here anchor_id in the text browser
-        
-        anchor_position = 1
-        # Original HTML
-        original_html = text_browser.toHtml()
-
-        # Changing anchors in the code to normal text
-        unique_marker = "U_N_"
-        u_m = "U_!"
-        replaced_html = original_html
-
-        pattern = r'<a name="\d+">'
-        matches = re.findall(pattern, replaced_html)
-
-        for match in matches:
-            index = re.search(r'\d+', match).group() 
-            replaced_html = replaced_html.replace(match, f'{unique_marker}{index}{u_m}')
-
-        # The new HTML is sending to hidden browser
-        hidden_browser = QTextBrowser()
-        hidden_browser.setHtml(replaced_html)
-        hidden_browser.resize(text_browser.size())
-
-        # Looking for the new text position
-        for match in matches:
-            index = re.search(r'\d+', match).group() 
-            
-            if str(index) == str(anchor_id):
-                anchor_position = hidden_browser.document().find(f'{unique_marker}{index}{u_m}').position()
-                if anchor_position != -1:
-                    break
-        
+        # Position of the message in the text browser, taken from the index made with the page
+        anchor_position = self.anchor_index.position_of(anchor_id) if anchor_id is not None else None
+        if anchor_position is None:
+            anchor_position = 1
         return anchor_position 
 
+    @profiler.profiled('get_id')
     def get_id(self, text_browser):
         # In this function we have the first and the last anchors in the visible area
+        first_id, last_id = self.anchor_index.visible_messages(text_browser)
+        return first_id, last_id
 
-        first_id = None
-        last_id = None
-
-        # Getting the visible area 
-        visible_rect = text_browser.viewport().visibleRegion().boundingRect()
+    def set_page(self, html_source):
+        # Every page goes through here, so the anchor index always matches the document
+        with profiler.span('setHtml', size=len(html_source)):
+            self.textBrowser.setHtml(html_source)
+        self.anchor_index.rebuild(self.textBrowser.document())
+
+    @profiler.profiled('slide_page')
+    def slide_page(self, forward):
+        # Adding 50 messages on one side of the page and removing the same number on the other,
+        # the messages on the screen stay where they were
+        messages = chat_data.messages_list
+        document = self.textBrowser.document()
+        layout = document.documentLayout()
+        scroll_bar = self.textBrowser.verticalScrollBar()
+        start_index = max(chat_data.start_message, 1)
+        end_index = chat_data.end_message
+        cursor = QTextCursor(document)
+
+        if forward:
+            new_end = min(end_index + 50, len(messages))
+            if new_end <= end_index:
+                return
+            new_start = max(start_index, new_end - 100)
+        else:
+            new_start = max(start_index - 50, 1)
+            if new_start >= start_index:
+                return
+            new_end = min(end_index, new_start + 100)
 
-        # Getting the text from the visible area
-        first_position = text_browser.cursorForPosition(visible_rect.topLeft()).position()
-        last_position = text_browser.cursorForPosition(visible_rect.bottomRight()).position()
+        self.updating_scrollbar = True
 
-        cursor = QTextCursor(text_browser.document())
-        cursor.setPosition(first_position)
-        cursor.movePosition(QTextCursor.StartOfBlock)
-        cursor.setPosition(last_position, QTextCursor.KeepAnchor)
-        visible_text = cursor.selection().toHtml()
-        
-        # looking for anchors
-        matches = re.findall(r'<a\s+name="([^"]*)"', visible_text)
-        if matches:
-            first_id = matches[0] 
-            last_id = matches[-1] 
+        if forward:
+            html_source = create_html_page(chat_data.text_browser_width, chat_data.main_dir, messages, end_index, new_end)
+            # New block, so the first message doesn't take the format of the last one
+            cursor.movePosition(QTextCursor.End)
+            cursor.insertBlock()
+            # Text added at the end leaves the positions of the old messages as they were
+            with profiler.span('insertHtml', size=len(html_source)):
+                cursor.insertHtml(html_source)
+
+            if new_start > start_index:
+                # The position in the page is the message number
+                cut_position = self.anchor_index.position_of(new_start)
+                if cut_position is not None:
+                    removed_height = layout.blockBoundingRect(document.findBlock(cut_position)).top()
+                    cursor.setPosition(0)
+                    cursor.setPosition(cut_position, QTextCursor.KeepAnchor)
+                    cursor.removeSelectedText()
+                    layout.documentSize()
+                    scroll_bar.setValue(scroll_bar.value() - int(removed_height))
         else:
-            first_id = first_id
-            last_id = last_id
+            html_source = create_html_page(chat_data.text_browser_width, chat_data.main_dir, messages, new_start, start_index)
+            cursor.setPosition(0)
+            cursor.insertBlock()
+            cursor.setPosition(0)
+            character_count = document.characterCount()
+            with profiler.span('insertHtml', size=len(html_source)):
+                cursor.insertHtml(html_source)
+            # The old messages moved by the length of the added text, the index is rebuilt once at the end
+            shift = document.characterCount() - character_count + 1
+
+            old_first_position = self.anchor_index.position_of(start_index)
+            if old_first_position is not None:
+                old_first_position += shift
+                added_height = layout.blockBoundingRect(document.findBlock(old_first_position)).top()
+                layout.documentSize()
+                scroll_bar.setValue(scroll_bar.value() + int(added_height))
+
+            if new_end < end_index:
+                cut_position = self.anchor_index.position_of(new_end)
+                if cut_position is not None:
+                    cursor.setPosition(cut_position + shift)
+                    cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
+                    cursor.removeSelectedText()
+
+        self.anchor_index.rebuild(document)
+        chat_data.start_message = new_start
+        chat_data.end_message = new_end
+        self.updating_scrollbar = False
 
-        #print(first_id, last_id)
-        return first_id, last_id
+    def on_thumbnail_ready(self, thumbnail_path, image_path):
+        image = image_cache.image(image_path, picture_width(fragment_width(chat_data.text_browser_width)))
+        if image is not None:
+            self.textBrowser.replace_image(QUrl.fromLocalFile(thumbnail_path), image)
+            if self.chat_view:
+                self.chat_view.replace_image(QUrl.fromLocalFile(thumbnail_path), image)
 
     def on_textBrowser_resize(self):
+        # Fragments of the old width will not be used again
+        if fragment_width(self.textBrowser.width()) != fragment_width(chat_data.text_browser_width):
+            fragment_cache.clear()
         chat_data.text_browser_width = self.textBrowser.width()
 
-    def update_progress_bar(self, progress):
-            dir = chat_data.main_dir
+    def update_progress_bar(self, phase, progress, eta):
+        # Percent of the whole task, phases only change the text
+        self.progressBar.setValue(progress)
+        message = f"{PHASE_TITLES.get(phase, phase)}: {progress}%"
+        if eta >= 0:
+            message += f", about {int(eta) + 1} s left"
+        self.statusBar().showMessage(message)
 
-            if progress < 100:
-                self.progressBar.setValue(progress)
-            else:
-                self.progressBar.setValue(0) 
-                message = f"Main folder: {dir}"
-                self.statusBar().showMessage(message)            
+    def on_progress_finished(self, task):
+        self.progressBar.setValue(0)
+        message = f"Main folder: {chat_data.main_dir}"
+        self.statusBar().showMessage(message)
+
+    def show_profiling(self):
+        from profiling_dialog import ProfilingDialog
+        ProfilingDialog(self).exec_()
 
     def open_link(self, url):
+        # Found messages have a link to their place in the chat
+        if url.scheme() == 'context':
+            self.show_context(int(url.path()))
+            return
         QDesktopServices.openUrl(QUrl(url.toString()))
+
+    def show_context(self, original_number):
+        # Leaving the results for the page around the message in the whole chat
+        self.stop_search()
+        chat_data.messages_list = chat_data.original_messages_list
+        chat_data.searchingFlag = False
+        self.on_messages_list_changed()
+        self.pushButton_Clean.setEnabled(False)
+
+        if self.chat_view:
+            self.chat_view.scroll_to_message(original_number)
+            return
+
+        start_index = max(original_number - 25, 1)
+        end_index = min(start_index + 50, len(chat_data.messages_list))
+        self.updating_scrollbar = True
+        self.textBrowser.clear()
+        html_source = create_html_page(chat_data.text_browser_width, chat_data.main_dir, chat_data.messages_list, start_index, end_index)
+        self.set_page(html_source)
+        chat_data.start_message = start_index
+        chat_data.end_message = end_index
+        position = self.anchor_index.position_of(original_number)
+        if position is not None:
+            cursor = QTextCursor(self.textBrowser.document())
+            cursor.setPosition(position)
+            self.textBrowser.setTextCursor(cursor)
+            self.textBrowser.ensureCursorVisible()
+        self.updating_scrollbar = False
     
     def load_json(self):
         fname, _ = QFileDialog.getOpenFileName(self, 'Open file', '/home', "JSON files (*.json)")
 
         if fname:
-            # Cleaning the browser after selected a new file
-            self.updating_scrollbar = True
-            self.textBrowser.clear()
-            self.updating_scrollbar = False
+            self.open_chat(fname)
 
-            self.load_thread = LoadJsonThread(fname)
-            self.load_thread.finished.connect(self.load_complete)
-            self.load_thread.start()
+    def open_chat(self, fname):
+        # The chat being left stays in the cache, a cached chat is shown without loading
+        self.remember_chat()
+        self.stop_loading()
 
-    def load_complete(self):
-        self.on_messages_list_changed()
-        chat_data.original_messages_list = chat_data.messages_list
+        # Cleaning the browser after selected a new file
+        self.updating_scrollbar = True
+        self.textBrowser.clear()
+        self.updating_scrollbar = False
+
+        self.first_page_shown = False
+        chat_data.first_message_name = Settings().get_first_name() or None
+        self.stop_search()
+        self.search_base = None
+        chat_data.searchingFlag = False
+        self.pushButton_Clean.setEnabled(False)
+        chat_data.messages_list = []
+        chat_data.original_messages_list = None
+        chat_data.search_index = None
+        chat_data.field_index = None
+        if self.index_thread is not None:
+            self.index_thread.requestInterruption()
+        fragment_cache.clear()
+        chat_data.start_message = 1
+        chat_data.end_message = 50
+        self.chat_path = fname
+
+        state = chat_cache.get(fname)
+        if state is not None:
+            chat_data.messages_list = state.messages
+            chat_data.main_dir = state.main_dir
+            if state.manifest is not None:
+                use_attachment_manifest(state.manifest)
+                # Files could change while the chat was closed
+                for name in state.manifest.refresh():
+                    image_cache.discard(os.path.join(state.main_dir, name))
+            chat_data.total_messages = len(state.messages)
+            chat_data.search_index = state.search_index
+            chat_data.field_index = state.field_index
+            self.load_complete()
+            self.on_progress_finished('load')
+            return
+
+        self.load_thread = LoadJsonThread(fname)
+        self.load_thread.batch_loaded.connect(self.on_batch_loaded)
+        self.load_thread.finished.connect(self.load_complete)
+        self.load_thread.start()
+
+    def remember_chat(self):
+        # Only a loaded chat is kept, an index that is still being built is made again on return
+        if self.chat_path and chat_data.original_messages_list is not None:
+            chat_cache.put(self.chat_path, ChatState(chat_data.original_messages_list, chat_data.main_dir,
+                                                     chat_data.search_index, chat_data.field_index,
+                                                     get_attachment_manifest(chat_data.main_dir)))
+
+    def stop_loading(self):
+        # Like stop_search, the old loader finishes on its own without touching the window
+        load_thread = self.load_thread
+        if load_thread is not None and load_thread.isRunning():
+            load_thread.batch_loaded.disconnect(self.on_batch_loaded)
+            load_thread.finished.disconnect(self.load_complete)
+            load_thread.requestInterruption()
+            self.stopped_loads.append(load_thread)
+            load_thread.finished.connect(lambda: self.stopped_loads.remove(load_thread))
+        self.load_thread = None
+
+    def open_takeout(self):
+        root = QFileDialog.getExistingDirectory(self, 'Open Takeout folder', '/home')
+        if root:
+            if self.catalog_thread is not None:
+                self.catalog_thread.requestInterruption()
+            self.catalog_thread = CatalogThread(root)
+            self.catalog_thread.finished.connect(self.on_catalog_ready)
+            self.catalog_thread.start()
+
+    def on_catalog_ready(self):
+        catalog_thread = self.sender()
+        if catalog_thread is not self.catalog_thread or catalog_thread.entries is None:
+            return
+        self.catalog_thread = None
+        entries = catalog_thread.entries
+        if not entries:
+            QMessageBox.information(self, "No chats", f"No messages.json found in '{catalog_thread.root}'")
+            return
+
+        self.chat_tree.blockSignals(True)
+        self.chat_tree.clear()
+        self.chat_tree.setSortingEnabled(False)
+        for entry in entries:
+            item = QTreeWidgetItem([entry.name])
+            item.setData(0, Qt.UserRole, entry.path)
+            item.setToolTip(0, entry.path)
+            # Numbers sort as numbers
+            item.setData(1, Qt.DisplayRole, entry.message_count)
+            item.setText(2, date_span_text(entry.first_timestamp, entry.last_timestamp))
+            item.setData(3, Qt.DisplayRole, round(entry.size / 2 ** 20, 1))
+            for column in (1, 3):
+                item.setTextAlignment(column, Qt.AlignRight | Qt.AlignVCenter)
+            self.chat_tree.addTopLevelItem(item)
+        self.chat_tree.setSortingEnabled(True)
+        self.chat_tree.sortByColumn(0, Qt.AscendingOrder)
+        self.chat_tree.resizeColumnToContents(0)
+        self.chat_tree.blockSignals(False)
+        self.chat_tree.show()
+        self.statusBar().showMessage(f"{len(entries)} chats in {catalog_thread.root}")
+
+    def export_chat(self):
+        if self.export_thread is not None:
+            # The same button stops the running export
+            self.export_thread.requestInterruption()
+            self.exportButton.setEnabled(False)
+            return
+        if not self.chat_path:
+            QMessageBox.information(self, "Export HTML", "Open a chat first")
+            return
+        output_dir = QFileDialog.getExistingDirectory(self, 'Folder for the HTML pages', os.path.dirname(self.chat_path))
+        if output_dir:
+            self.exportButton.setText("Cancel export")
+            self.export_thread = ExportThread(self.chat_path, output_dir)
+            self.export_thread.finished.connect(self.on_export_finished)
+            self.export_thread.start()
+
+    def on_export_finished(self):
+        export_thread = self.export_thread
+        self.export_thread = None
+        self.exportButton.setText("Export HTML")
+        self.exportButton.setEnabled(True)
+        if export_thread.pages is not None:
+            self.statusBar().showMessage(f"{len(export_thread.pages)} pages exported: {os.path.join(export_thread.output_dir, INDEX_FILE_NAME)}")
+        else:
+            self.statusBar().showMessage("Export cancelled")
+
+    def on_chat_selected(self, item, previous_item):
+        if item is not None and item.data(0, Qt.UserRole) != self.chat_path:
+            self.open_chat(item.data(0, Qt.UserRole))
+
+    def on_batch_loaded(self, count):
+        if self.chat_view:
+            self.chat_view.messages_appended()
+        # Showing the first 50 messages as soon as they are parsed
+        elif not self.first_page_shown and count > 50:
+            self.show_first_page()
+
+    def show_first_page(self):
+        self.first_page_shown = True
         text_browser_width = self.textBrowser.width()
         chat_data.text_browser_width = text_browser_width
         html_source = create_html_page(text_browser_width, chat_data.main_dir, chat_data.messages_list, start_index=1, end_index=50)
-        self.textBrowser.setHtml(html_source)
+        self.updating_scrollbar = True
+        self.set_page(html_source)
+        self.updating_scrollbar = False
+
+    def load_complete(self):
+        self.on_messages_list_changed()
+        chat_data.original_messages_list = chat_data.messages_list
+        self.watch_attachments(chat_data.main_dir)
+        # The list view draws its rows itself, the hidden text browser gets no page
+        if not self.chat_view and not self.first_page_shown:
+            self.show_first_page()
+        save_image_size_cache()
+
+        # The database has its own full-text index, a chat from the cache can have its indexes already
+        if not isinstance(chat_data.original_messages_list, StoredMessageList) and chat_data.search_index is None:
+            self.index_thread = SearchIndexThread(chat_data.original_messages_list)
+            self.index_thread.start()
+
+    def closeEvent(self, event):
+        # Sizes probed while scrolling
+        save_image_size_cache()
+        super().closeEvent(event)
+
+    def watch_attachments(self, directory):
+        watched = self.attachment_watcher.directories()
+        if watched != [directory]:
+            if watched:
+                self.attachment_watcher.removePaths(watched)
+            self.attachment_watcher.addPath(directory)
+
+    def on_attachments_changed(self):
+        # Messages with the files that came, went or changed are drawn again
+        if not chat_data.main_dir:
+            return
+        changed_names = get_attachment_manifest(chat_data.main_dir).refresh()
+        if not changed_names:
+            return
+        fragment_cache.clear()
+        # Pictures decoded from the old files
+        for name in changed_names:
+            image_cache.discard(os.path.join(chat_data.main_dir, name))
+        if self.chat_view:
+            self.chat_view.redraw_messages()
+        elif chat_data.messages_list and chat_data.end_message > 0:
+            # The same messages at the same place
+            scroll_bar = self.textBrowser.verticalScrollBar()
+            position = scroll_bar.value()
+            self.updating_scrollbar = True
+            html_source = create_html_page(chat_data.text_browser_width, chat_data.main_dir, chat_data.messages_list,
+                                           max(chat_data.start_message, 1), chat_data.end_message)
+            self.set_page(html_source)
+            scroll_bar.setValue(position)
+            self.updating_scrollbar = False
 
+    @profiler.profiled('scroll')
     def on_scroll_changed(self):
         # Stop if its a start position
         if chat_data.start_message < 0:
@@ -381,6 +908,10 @@ class MainWindow(QMainWindow):
 
             # Check of the norders
             if current_position == max_position or current_position == 0:
+                if Settings().get_incremental_scroll():
+                    self.slide_page(current_position == max_position)
+                    return
+
                 first_id, last_id = self.get_id(self.textBrowser)
                 # If its the enf
                 if current_position == max_position:
@@ -420,7 +951,7 @@ class MainWindow(QMainWindow):
                 self.updating_scrollbar = True
                 # Loading the new data
                 html_source = create_html_page(chat_data.text_browser_width, chat_data.main_dir, chat_data.messages_list, start_index=chat_data.start_message, end_index=chat_data.end_message)
-                self.textBrowser.setHtml(html_source)
+                self.set_page(html_source)
                 
                 # Here is a new cursor for moving inside the browser and set the correct position after updating
                 main_cursor = QTextCursor(self.textBrowser.document())
@@ -438,7 +969,7 @@ class MainWindow(QMainWindow):
                 
                 # Checking the size of the browser window for moving correction data 
                 visible_lines = self.get_visible_lines(self.textBrowser)
-                correction = visible_lines // (int(last_id) - int(first_id)) if ((int(last_id) - int(first_id))) > 0 else 0
+                correction = visible_lines // (int(last_id) - int(first_id)) if first_id is not None and last_id is not None and (int(last_id) - int(first_id)) > 0 else 0
 
                 # checking the direction we are moving
                 if current_position == max_position: